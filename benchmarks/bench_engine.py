@@ -0,0 +1,200 @@
+"""
+End-to-end benchmark: crawl a local mock site with the Engine under several spider configurations.
+
+    python -m benchmarks.bench_engine --pages 2000 --latency 0.01
+    python -m benchmarks.bench_engine --scenario default --scenario bloom --json results.json
+
+Each scenario runs in its own process, so that peak RSS and CPU time are its own; the mock site runs in
+another process.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import queue
+import resource
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.mock_site import start_site_process
+
+# Spider settings of each scenario, on top of BASE_SETTINGS
+SCENARIOS: Dict[str, Dict] = {
+    'default': {},
+    'fifo': {'FRONTIER': 'fifo'},
+    'disk_frontier': {'FRONTIER': 'disk', 'FRONTIER_MEMORY_SIZE': 100},
+    'bloom': {'DUPEFILTER': 'bloom', 'DUPEFILTER_CAPACITY': 1_000_000},
+    'autothrottle': {'AUTOTHROTTLE_ENABLED': True, 'AUTOTHROTTLE_MAX_CONCURRENCY': 32},
+    'low_concurrency': {'CONCURRENT_REQUESTS': 4, 'CONCURRENT_REQUESTS_PER_DOMAIN': 4},
+}
+
+BASE_SETTINGS = {
+    'DOWNLOAD_DELAY': 0,
+    'DOWNLOAD_DELAY_JITTER': 0,
+    'CONCURRENT_REQUESTS': 32,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 32,
+    'LOG_LEVEL': 'WARNING',
+    'STATS_LOG_INTERVAL': None,
+    'RETRY_BACKOFF_BASE': 0.05,
+}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _run_scenario(name: str, settings: Dict, start_url: str, concurrency: int, results):
+    # Imported in the scenario process only
+    from core.engine import Engine
+    from core.item import StableItem
+    from core.request import StableRequest
+    from core.spider import Spider
+    from core.stats import StatsCollector
+
+    class PageItem(StableItem):
+        url: str
+        title: str
+
+    class BenchSpider(Spider):
+        SPIDER_NAME = f"bench_{name}"
+        START_URL_LIST = [start_url]
+
+        async def start_request(self):
+            for url in self.start_url_list:
+                yield StableRequest(url, callback=self.parse)
+
+        async def parse(self, response, meta):
+            yield PageItem(url=str(response.url), title=response.xpath('//title/text()').get())
+            for href in response.xpath('//a/@href').getall():
+                yield StableRequest(str(response.url.join(href)), callback=self.parse)
+
+    class RecordingStats(StatsCollector):
+        """Keeps every download latency, the histograms only give bucket bounds"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.download_latencies: List[float] = []
+
+        def observe(self, name: str, value: float):
+            super().observe(name, value)
+            if name == 'download_latency':
+                self.download_latencies.append(value)
+
+    spider_class = type('BenchSpider', (BenchSpider,), dict(settings))
+    spider = spider_class()
+    engine = Engine(spider, concurrency=concurrency)
+    engine.stats = RecordingStats.from_spider(spider)
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    asyncio.run(engine.start())
+    elapsed = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    # Pages downloaded, the requests dropped by the dupefilter are processed too but never sent
+    pages = int(sum(value for key, value in engine.stats.counters.items() if key.startswith('response_status/')))
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    latencies = engine.stats.download_latencies
+    results.put({
+        'scenario': name,
+        'pages': pages,
+        'items': int(engine.stats.get_value('items_scraped')),
+        'elapsed': elapsed,
+        'pages_per_sec': pages / elapsed if elapsed else 0.0,
+        'latency_p50_ms': _percentile(latencies, 0.5) * 1000,
+        'latency_p99_ms': _percentile(latencies, 0.99) * 1000,
+        'latency_mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        'peak_rss_mb': usage_after.ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+        'cpu_ms_per_page': cpu / pages * 1000 if pages else 0.0,
+    })
+
+
+def run_scenario(
+        name: str, settings: Dict, start_url: str, concurrency: int, timeout: Optional[float] = None
+) -> Dict:
+    """Run one scenario in a fresh process and return its measurements, or a failed result if it did not finish"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_scenario, args=(name, settings, start_url, concurrency, results))
+    process.start()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    result = None
+    error = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # The result may have been sent right before the process exited
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    error = f"process exited with code {process.exitcode}"
+                    break
+            elif deadline is not None and time.monotonic() > deadline:
+                process.terminate()
+                error = f"timed out after {timeout} seconds"
+                break
+    process.join()
+    if result is None:
+        return {'scenario': name, 'failed': True, 'error': error}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end crawl benchmark against a local mock site")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="default: all of them")
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--links-per-page', type=int, default=10)
+    parser.add_argument('--page-size', type=int, default=10_000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=32, help="engine worker tasks")
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--timeout', type=float, help="seconds after which a scenario is stopped and failed")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    site = start_site_process(
+        pages=args.pages,
+        links_per_page=args.links_per_page,
+        page_size=args.page_size,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        port=args.port,
+    )
+    start_url = f"http://127.0.0.1:{args.port}/page/0"
+    results = []
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            settings = {**BASE_SETTINGS, **SCENARIOS[name]}
+            result = run_scenario(name, settings, start_url, args.concurrency, timeout=args.timeout)
+            results.append(result)
+            if result.get('failed'):
+                print(f"{name:<16} FAILED: {result['error']}")
+                continue
+            print(
+                f"{name:<16} {result['pages']:>6} pages {result['pages_per_sec']:>8.1f} pages/s  "
+                f"p50 {result['latency_p50_ms']:>7.2f} ms  p99 {result['latency_p99_ms']:>7.2f} ms  "
+                f"peak RSS {result['peak_rss_mb']:>6.1f} MB  CPU {result['cpu_ms_per_page']:>6.2f} ms/page"
+            )
+    finally:
+        site.terminate()
+        site.join()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if any(result.get('failed') for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Memory benchmark: bytes held per request waiting in the frontier.
+
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --requests 200000 --json results.json
+
+Requests are built the way callbacks usually build them (a URL, a callback, sometimes a meta dict) and pushed
+on a PriorityFrontier; the memory they hold is measured with tracemalloc.
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from typing import Callable, Dict, List
+
+from core.frontier import PriorityFrontier
+from core.request import StableRequest
+
+
+class BenchSpider:
+    def parse(self, response, meta):
+        pass
+
+
+def plain_requests(spider: BenchSpider, n: int) -> StableRequest:
+    return StableRequest(f"https://example{n % 50}.com/catalog/page/{n}", callback=spider.parse)
+
+
+def meta_requests(spider: BenchSpider, n: int) -> StableRequest:
+    return StableRequest(
+        f"https://example{n % 50}.com/catalog/page/{n}", callback=spider.parse, meta={'depth': n % 10}, priority=n % 3
+    )
+
+
+def header_requests(spider: BenchSpider, n: int) -> StableRequest:
+    return StableRequest(
+        f"https://example{n % 50}.com/api/items?page={n}", callback=spider.parse,
+        headers={'Accept': 'application/json'}
+    )
+
+
+SCENARIOS: Dict[str, Callable[[BenchSpider, int], StableRequest]] = {
+    'plain': plain_requests,
+    'meta': meta_requests,
+    'headers': header_requests,
+}
+
+
+def measure(build: Callable[[BenchSpider, int], StableRequest], number: int) -> float:
+    """Bytes allocated per queued request, URL strings excluded since every layout needs them"""
+    spider = BenchSpider()
+    urls_size = 0
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    frontier = PriorityFrontier()
+    for n in range(number):
+        request = build(spider, n)
+        urls_size += len(request.url) + 49  # Size of a compact ASCII str object
+        frontier.push(request)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(frontier) == number
+    return (after - before - urls_size) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory held per queued request")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="default: all of them")
+    parser.add_argument('--requests', type=int, default=100_000)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+    for name in args.scenario or list(SCENARIOS):
+        per_request = measure(SCENARIOS[name], args.requests)
+        results.append({'scenario': name, 'requests': args.requests, 'bytes_per_request': per_request})
+        print(f"{name:<10} {per_request:>8.1f} bytes per queued request")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Micro-benchmarks of the per-page hot paths: response parsing, field extraction, request fingerprinting,
+duplicate filtering and the item pipeline.
+
+    python -m benchmarks.bench_micro
+    python -m benchmarks.bench_micro --only parse --number 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+import timeit
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.mock_site import MockSite
+from core.dupefilter import BloomSeenSet, MemorySeenSet
+from core.extractor import Extractor, Field
+from core.item import StableItem
+from core.pipeline import ItemPipeline
+from core.request import StableRequest
+from core.response import StableResponse
+from core.spider import Spider
+from middlewares.item_middleware import ItemMiddleware
+from utils.fingerprint import canonicalize_url, request_fingerprint
+
+
+class BenchItem(StableItem):
+    url: str
+    title: str
+
+
+class PageItem(StableItem):
+    title: str
+    links: List[str]
+    heading: Optional[str] = None
+
+
+class BenchSpider(Spider):
+    SPIDER_NAME = 'bench_micro'
+    LOG_LEVEL = 'WARNING'
+    STATS_LOG_INTERVAL = None
+
+
+class BulkMiddleware(ItemMiddleware):
+    BATCH_SIZE = 500
+
+    async def save_items(self, items):
+        return items
+
+
+def _make_response(site: MockSite, n: int) -> StableResponse:
+    url = f"http://127.0.0.1/page/{n}"
+    response = httpx.Response(
+        200, headers={'content-type': 'text/html; charset=utf-8'}, content=site.render(n),
+        request=httpx.Request('GET', url)
+    )
+    return StableResponse(response=response, request=StableRequest(url))
+
+
+def bench_parse(number: int) -> Callable[[], None]:
+    site = MockSite(pages=number, page_size=10_000)
+    responses = [_make_response(site, n) for n in range(number)]
+
+    def run():
+        for response in responses:
+            response.release()
+            response.xpath('//title/text()').get()
+            response.xpath('//a/@href').getall()
+            response.css('h1::text').get()
+
+    return run
+
+
+def bench_extract(number: int) -> Callable[[], None]:
+    """The queries of bench_parse, compiled once by an Extractor and validated into an item"""
+    site = MockSite(pages=number, page_size=10_000)
+    responses = [_make_response(site, n) for n in range(number)]
+    extractor = Extractor(PageItem, {
+        'title': '//title/text()',
+        'links': Field(xpath='//a/@href', many=True),
+        'heading': Field(css='h1::text'),
+    })
+
+    def run():
+        for response in responses:
+            response.release()
+        extractor.extract_all(responses)
+
+    return run
+
+
+def bench_fingerprint(number: int) -> Callable[[], None]:
+    requests = [
+        StableRequest(f"http://Example.com:80/page/{n}?b=2&a=1#top", params={'page': n}) for n in range(number)
+    ]
+    posts = [StableRequest("http://example.com/search", method='POST', json={'q': n}) for n in range(number)]
+
+    def run():
+        for request in requests:
+            request_fingerprint(request)
+        for request in posts:
+            request_fingerprint(request)
+
+    return run
+
+
+def bench_canonicalize(number: int) -> Callable[[], None]:
+    urls = [f"HTTP://Example.com:80/page/{n}?b=2&a=1#top" for n in range(number)]
+
+    def run():
+        for url in urls:
+            canonicalize_url(url)
+
+    return run
+
+
+def bench_seen_set(number: int) -> Callable[[], None]:
+    fingerprints = [request_fingerprint(StableRequest(f"http://example.com/{n}")) for n in range(number)]
+
+    def run():
+        for seen_set in (MemorySeenSet(max_memory=None), BloomSeenSet(capacity=number * 2)):
+            for fingerprint in fingerprints:
+                seen_set.add(fingerprint)
+            for fingerprint in fingerprints:
+                seen_set.add(fingerprint)
+
+    return run
+
+
+def bench_pipeline(number: int) -> Callable[[], None]:
+    spider = BenchSpider()
+    items = [BenchItem(url=f"http://example.com/{n}", title=f"Page {n}") for n in range(number)]
+
+    async def crawl():
+        pipeline = ItemPipeline(
+            spider=spider, item_middleware_instances=[ItemMiddleware(spider), BulkMiddleware(spider)]
+        )
+        pipeline.start()
+        for item in items:
+            await pipeline.put(item)
+        await pipeline.close()
+
+    def run():
+        asyncio.run(crawl())
+
+    return run
+
+
+BENCHMARKS: Dict[str, Callable[[int], Callable[[], None]]] = {
+    'parse': bench_parse,
+    'extract': bench_extract,
+    'fingerprint': bench_fingerprint,
+    'canonicalize': bench_canonicalize,
+    'seen_set': bench_seen_set,
+    'pipeline': bench_pipeline,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the crawler's hot paths")
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS), help="default: all of them")
+    parser.add_argument('--number', type=int, default=1000, help="operations per run")
+    parser.add_argument('--repeat', type=int, default=5, help="runs, the best one is reported")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+    for name in args.only or list(BENCHMARKS):
+        run = BENCHMARKS[name](args.number)
+        timer = timeit.Timer(run, timer=time.perf_counter)
+        best = min(timer.repeat(repeat=args.repeat, number=1))
+        results.append({
+            'benchmark': name, 'number': args.number, 'best': best, 'us_per_op': best / args.number * 1e6
+        })
+        print(f"{name:<14} {best * 1000:>9.2f} ms per {args.number} ops  {best / args.number * 1e6:>9.2f} us/op")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
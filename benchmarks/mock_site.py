@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import multiprocessing
+import random
+from typing import Dict, List, Optional
+
+
+class MockSite:
+    def __init__(
+            self,
+            pages: int = 1000,
+            links_per_page: int = 10,
+            page_size: int = 10_000,
+            latency: float = 0.0,
+            latency_jitter: float = 0.0,
+            error_rate: float = 0.0,
+            seed: int = 0,
+            host: str = '127.0.0.1',
+            port: int = 8900
+    ):
+        """
+        Stand-in web site for benchmarks, served by a plain asyncio HTTP/1.1 server with keep-alive.
+
+        Page n is served at /page/n and links to links_per_page other pages drawn from a seeded random
+        link graph, so every run crawls the same site. Page 0 reaches every page.
+
+        Args:
+            pages: number of pages of the site.
+            links_per_page: outgoing links of each page.
+            page_size: approximate size of a page body, in bytes.
+            latency: artificial delay before each response, in seconds.
+            latency_jitter: additional random delay range, in seconds.
+            error_rate: share of the responses answered with a 503.
+            seed: seed of the link graph, the latency jitter and the errors.
+            host: interface the server listens on.
+            port: port the server listens on.
+        """
+        self.pages = pages
+        self.links_per_page = links_per_page
+        self.page_size = page_size
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self._random = random.Random(seed)
+        self._links = self._build_links(random.Random(seed))
+        self._pages: Dict[int, bytes] = {}  # Rendered pages
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def start_url(self) -> str:
+        return f"http://{self.host}:{self.port}/page/0"
+
+    def _build_links(self, rng: random.Random) -> List[List[int]]:
+        links = []
+        for n in range(self.pages):
+            # The first link chains the pages, so that the whole site is reachable from page 0
+            page_links = [(n + 1) % self.pages]
+            page_links.extend(rng.randrange(self.pages) for _ in range(self.links_per_page - 1))
+            links.append(page_links)
+        return links
+
+    def render(self, n: int) -> bytes:
+        anchors = ''.join(f'<li><a href="/page/{link}">Page {link}</a></li>' for link in self._links[n])
+        head = f'<html><head><title>Page {n}</title></head><body><h1>Page {n}</h1><ul>{anchors}</ul>'
+        filler_size = max(0, self.page_size - len(head) - 20)
+        paragraph = '<p>' + 'lorem ipsum dolor sit amet ' * 8 + '</p>'
+        filler = paragraph * (filler_size // len(paragraph) + 1)
+        return (head + filler[:filler_size] + '</body></html>').encode('utf-8')
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = True
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    if header.lower().startswith(b'connection:') and b'close' in header.lower():
+                        keep_alive = False
+
+                parts = request_line.decode('latin-1').split()
+                path = parts[1] if len(parts) > 1 else '/'
+                delay = self.latency + self._random.uniform(0, self.latency_jitter)
+                if delay:
+                    await asyncio.sleep(delay)
+
+                status, body = '200 OK', b''
+                if self.error_rate and self._random.random() < self.error_rate:
+                    status = '503 Service Unavailable'
+                elif path.startswith('/page/') and path[6:].isdigit() and int(path[6:]) < self.pages:
+                    n = int(path[6:])
+                    body = self._pages.get(n)
+                    if body is None:
+                        body = self._pages[n] = self.render(n)
+                else:
+                    status = '404 Not Found'
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: text/html; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+
+def _run_site(kwargs: dict, ready):
+    async def main():
+        site = MockSite(**kwargs)
+        await site.start()
+        ready.set()
+        await site._server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_site_process(**kwargs) -> multiprocessing.Process:
+    """Serve a MockSite from a separate process, so its CPU time does not count for the crawler"""
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=_run_site, args=(kwargs, ready), daemon=True)
+    process.start()
+    if not ready.wait(timeout=10):
+        process.terminate()
+        raise RuntimeError("Mock site did not start")
+    return process
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a mock site for benchmarks")
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--links-per-page', type=int, default=10)
+    parser.add_argument('--page-size', type=int, default=10_000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8900)
+    args = parser.parse_args()
+    site = MockSite(
+        pages=args.pages,
+        links_per_page=args.links_per_page,
+        page_size=args.page_size,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        port=args.port,
+    )
+    print(f"Serving {args.pages} pages on {site.start_url}")
+    asyncio.run(site.serve_forever())
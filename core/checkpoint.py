@@ -0,0 +1,288 @@
+import itertools
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from core.request import BaseRequest
+from utils.serialization import json_default, json_object_hook
+
+
+class CrawlState:
+    def __init__(self, pending: Dict[int, Dict] = None, seen: List[str] = None, counters: Dict = None,
+                 next_id: int = 0, finished: bool = False):
+        """
+        State of a crawl as stored in a job directory.
+
+        Args:
+            pending: serialized requests not processed yet, by job id.
+            seen: hex prefixes of the fingerprints in the seen set.
+            counters: crawl counters.
+            next_id: next job id to assign.
+            finished: whether the crawl ran to completion.
+        """
+        self.pending = pending if pending is not None else {}
+        self.seen = seen if seen is not None else []
+        self.counters = counters if counters is not None else {}
+        self.next_id = next_id
+        self.finished = finished
+
+    def apply(self, entry: Dict):
+        """Replay a journal entry"""
+        op = entry['op']
+        if op == 'push':
+            self.pending[entry['id']] = entry['request']
+            self.next_id = max(self.next_id, entry['id'] + 1)
+        elif op == 'done':
+            self.pending.pop(entry['id'], None)
+        elif op == 'accept':
+            # The pending request passed the filter, it is not filtered again on resume
+            request = self.pending.get(entry['id'])
+            if request is not None:
+                request['need_request_filter'] = False
+
+
+class JobDir:
+    STATE_FILE = 'state.json'
+    SEEN_FILE = 'seen.txt'
+    JOURNAL_PREFIX = 'journal-'
+
+    def __init__(self, path: str, counters: Optional[Dict] = None, compact_every: int = 10000):
+        """
+        Crawl checkpoints in a job directory.
+
+        New fingerprints are appended to a seen file, pushed, accepted and processed requests to journal
+        segments of compact_every entries. When a segment is closed, the oldest segments that are mostly
+        processed requests are compacted: their pending requests are copied to the new segment and the
+        segment is deleted. Compaction work is proportional to the entries it removes, never to the size
+        of the crawl. The counters are written to a small state file along the way.
+
+        All file writes happen on a background thread, recording an entry only queues it.
+
+        Args:
+            path: the job directory.
+            counters: crawl counters, copied into the state file whenever a segment is closed.
+            compact_every: number of journal entries per segment.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.path / self.STATE_FILE
+        self.seen_path = self.path / self.SEEN_FILE
+        self.counters = counters if counters is not None else {}
+        self.compact_every = compact_every
+        self._ids = itertools.count()
+        self._entries = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        # Owned by the writer thread
+        self._next_id = 0
+        self._segment = 0
+        self._live: Dict[int, int] = {}  # Segment holding the push of each pending request
+        self._accepted = set()  # Pending requests that passed the filter
+        self._segment_lines: Dict[int, int] = {}
+        self._segment_live: Dict[int, int] = {}  # Pending requests pushed in each segment
+
+    def load(self) -> Optional[CrawlState]:
+        """Read the state left by a previous run, None if there is nothing to resume."""
+        state = self._read_state()
+        if state is None or state.finished:
+            return None
+        self._ids = itertools.count(state.next_id)
+        return state
+
+    def start(self, state: Optional[CrawlState] = None):
+        """Start journaling, on top of the resumed state if any, otherwise from scratch"""
+        if state is None:
+            self._remove_files()
+        self._thread = threading.Thread(
+            target=self._write_loop, args=(state,), name=f"JobDir({self.path})", daemon=True
+        )
+        self._thread.start()
+
+    def record_push(self, request: BaseRequest):
+        """Journal a new pending request"""
+        request.job_id = next(self._ids)
+        data = request.to_dict()
+        # The writer thread serializes the entry later, the middlewares may change these dicts meanwhile
+        data['headers'] = dict(data['headers']) if data['headers'] is not None else None
+        data['meta'] = dict(data['meta']) if data['meta'] is not None else None
+        self._entries.put({'op': 'push', 'id': request.job_id, 'request': data})
+
+    def record_done(self, request: BaseRequest):
+        """Journal that a request has been processed"""
+        if request.job_id is not None:
+            self._entries.put({'op': 'done', 'id': request.job_id})
+
+    def record_seen(self, fingerprint: bytes, job_id: Optional[int] = None):
+        """Journal a new fingerprint of the seen set, added by the filter of the request job_id if any"""
+        self._entries.put({'op': 'seen', 'fp': fingerprint[:8].hex(), 'id': job_id})
+
+    def close(self, finished: bool = False):
+        """Flush the journal, waiting for the background thread"""
+        self._entries.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._write_state(finished)
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.path / f"{self.JOURNAL_PREFIX}{segment:06d}.jsonl"
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(path.stem[len(self.JOURNAL_PREFIX):]) for path in self.path.glob(f"{self.JOURNAL_PREFIX}*.jsonl")
+        )
+
+    def _remove_files(self):
+        for segment in self._segments():
+            self._segment_path(segment).unlink(missing_ok=True)
+        self.seen_path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
+
+    def _write_loop(self, state: Optional[CrawlState]):
+        seen_file = open(self.seen_path, 'a', encoding='utf-8')
+        journal = self._open_segment(state)
+        entries = 0
+        try:
+            while True:
+                entry = self._entries.get()
+                if entry is None:
+                    break
+
+                op = entry['op']
+                if op == 'seen':
+                    seen_file.write(entry['fp'] + '\n')
+                    if entry['id'] in self._live:
+                        self._accepted.add(entry['id'])
+                        self._write(journal, {'op': 'accept', 'id': entry['id']})
+                        entries += 1
+                else:
+                    self._track(entry)
+                    self._write(journal, entry)
+                    entries += 1
+
+                # Flush when the loop has nothing more to write for now
+                if self._entries.empty():
+                    seen_file.flush()
+                    journal.flush()
+
+                if entries >= self.compact_every:
+                    seen_file.flush()
+                    journal.close()
+                    self._write_state()
+                    self._segment += 1
+                    journal = open(self._segment_path(self._segment), 'a', encoding='utf-8')
+                    self._compact(journal)
+                    entries = 0
+        finally:
+            seen_file.close()
+            journal.close()
+
+    def _open_segment(self, state: Optional[CrawlState]):
+        """Open the first segment of this run, holding the pending requests of the resumed crawl"""
+        segments = self._segments()
+        self._segment = segments[-1] + 1 if segments else 0
+        journal = open(self._segment_path(self._segment), 'a', encoding='utf-8')
+        if state is None:
+            return journal
+
+        # Written once at resume, the segments of the previous run are then obsolete
+        self._next_id = state.next_id
+        for job_id, request in state.pending.items():
+            self._track({'op': 'push', 'id': job_id})
+            self._write(journal, {'op': 'push', 'id': job_id, 'request': request})
+        journal.flush()
+        os.fsync(journal.fileno())
+        for segment in segments:
+            self._segment_path(segment).unlink(missing_ok=True)
+        return journal
+
+    def _track(self, entry: Dict):
+        """Keep the per segment accounting of the pending requests"""
+        segment = self._segment
+        self._segment_lines[segment] = self._segment_lines.get(segment, 0) + 1
+        if entry['op'] == 'push':
+            self._live[entry['id']] = segment
+            self._segment_live[segment] = self._segment_live.get(segment, 0) + 1
+            self._next_id = max(self._next_id, entry['id'] + 1)
+        elif entry['op'] == 'done':
+            pushed_in = self._live.pop(entry['id'], None)
+            if pushed_in is not None:
+                self._segment_live[pushed_in] -= 1
+            self._accepted.discard(entry['id'])
+
+    @staticmethod
+    def _write(journal, entry: Dict):
+        journal.write(json.dumps(entry, default=json_default) + '\n')
+
+    def _compact(self, journal):
+        """Delete the oldest segments that are mostly processed requests, copying their pending ones to journal"""
+        copied = False
+        while True:
+            oldest = min(self._segment_lines, default=self._segment)
+            if oldest == self._segment or self._segment_live.get(oldest, 0) * 2 > self._segment_lines[oldest]:
+                break
+
+            # Done and accept entries of the oldest segment only refer to requests pushed in it
+            with open(self._segment_path(oldest), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line, object_hook=json_object_hook)
+                    except ValueError:
+                        break
+                    if entry['op'] != 'push' or self._live.get(entry['id']) != oldest:
+                        continue
+                    if entry['id'] in self._accepted:
+                        entry['request']['need_request_filter'] = False
+                    self._track(entry)
+                    self._segment_live[oldest] -= 1
+                    self._write(journal, entry)
+                    copied = True
+
+            # The copies must be on disk before the segment goes away
+            if copied:
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._segment_path(oldest).unlink(missing_ok=True)
+            self._segment_lines.pop(oldest, None)
+            self._segment_live.pop(oldest, None)
+
+    def _write_state(self, finished: bool = False):
+        """Atomically replace the state file"""
+        state = {'counters': dict(self.counters), 'next_id': self._next_id, 'finished': finished}
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def _read_state(self) -> Optional[CrawlState]:
+        segments = self._segments()
+        if not self.state_path.exists() and not segments:
+            return None
+
+        state = CrawlState()
+        if self.state_path.exists():
+            with open(self.state_path, encoding='utf-8') as f:
+                data = json.load(f)
+            state.counters = data['counters']
+            state.next_id = data['next_id']
+            state.finished = data['finished']
+
+        if self.seen_path.exists():
+            with open(self.seen_path, encoding='utf-8') as f:
+                # A last line cut short by a crash is not a full fingerprint prefix
+                state.seen = [line.strip() for line in f if len(line.strip()) == 16]
+
+        for segment in segments:
+            with open(self._segment_path(segment), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line, object_hook=json_object_hook)
+                    except ValueError:
+                        # Last line of the segment cut short by a crash
+                        break
+                    state.apply(entry)
+        return state
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from typing import Optional
+
+from core.httpcache import HttpCache, HttpCacheMiss
+from core.politeness import Politeness
+from core.request import BaseRequest, StableRequest
+from core.response import StableResponse
+from core.spider import Spider
+from core.stats import StatsCollector
+from core.throttle import AutoThrottle
+
+
+class Downloader:
+    def __init__(
+            self,
+            spider: 'Spider',
+            politeness: Optional[Politeness] = None,
+            throttle: Optional[AutoThrottle] = None,
+            stats: Optional[StatsCollector] = None,
+            http_cache: Optional[HttpCache] = None
+    ):
+        """
+        Send requests on behalf of the scheduler.
+
+        Args:
+            spider: the spider the requests belong to, provides the shared HTTP client.
+            politeness: per-domain politeness, built from the spider's settings if omitted.
+            throttle: adapts the politeness to the responses, built from the spider's settings if omitted
+                and AUTOTHROTTLE_ENABLED is set.
+            stats: collects the download metrics.
+            http_cache: serves and revalidates cached responses, built from the spider's settings if omitted
+                and HTTPCACHE_ENABLED is set.
+        """
+        self.spider = spider
+        self.politeness = politeness if politeness is not None else Politeness(
+            delay=spider.DOWNLOAD_DELAY,
+            jitter=spider.DOWNLOAD_DELAY_JITTER,
+            concurrency_per_domain=spider.CONCURRENT_REQUESTS_PER_DOMAIN,
+        )
+        if throttle is None and spider.AUTOTHROTTLE_ENABLED:
+            throttle = AutoThrottle.from_spider(spider, politeness=self.politeness)
+        self.throttle = throttle
+        self.stats = stats if stats is not None else StatsCollector(spider=spider, log_interval=None)
+        if http_cache is None and spider.HTTPCACHE_ENABLED:
+            http_cache = HttpCache.from_spider(spider)
+        self.http_cache = http_cache
+        self.sessions = spider.sessions if spider.COOKIES_ENABLED else None
+        # Bound the number of requests the spider has in flight at the same time
+        self.concurrency_limit = asyncio.Semaphore(spider.CONCURRENT_REQUESTS)
+
+    async def fetch(self, request: BaseRequest) -> StableResponse:
+        if isinstance(request, StableRequest) and request.max_body_size is None:
+            request.max_body_size = self.spider.DOWNLOAD_MAXSIZE
+        http_cache = self.http_cache
+        if http_cache is None or not http_cache.is_cacheable(request):
+            return await self._download(request)
+
+        # Fresh responses are served straight from the cache, without waiting for the host
+        entry = await http_cache.get(request)
+        if entry is not None and http_cache.is_fresh(entry):
+            self.stats.inc('httpcache/hit')
+            return http_cache.to_response(entry, request)
+        if http_cache.replay:
+            self.stats.inc('httpcache/miss')
+            raise HttpCacheMiss(request.url)
+
+        # Otherwise ask the server whether the cached response changed, without keeping the validators on the request
+        headers = request.headers
+        request.headers = {**headers, **http_cache.get_validators(entry)}
+        try:
+            response = await self._download(request)
+        finally:
+            request.headers = headers
+        if entry is not None and response.status_code == 304:
+            self.stats.inc('httpcache/revalidated')
+            await http_cache.refresh(entry, response)
+            return http_cache.to_response(entry, request)
+
+        self.stats.inc('httpcache/miss')
+        if await http_cache.store(request, response):
+            self.stats.inc('httpcache/stored')
+        return response
+
+    async def _download(self, request: BaseRequest) -> StableResponse:
+        # Wait for the host first, so that a busy host does not hold one of the spider's slots
+        await self.politeness.acquire(request)
+        try:
+            async with self.concurrency_limit:
+                self.stats.inc('requests_sent')
+                start = time.monotonic()
+                try:
+                    if self.sessions is not None and isinstance(request, StableRequest):
+                        response = await self._fetch_with_cookies(request)
+                    else:
+                        response = await request.fetch(client=self.spider.http_client)
+                except Exception as e:
+                    self.stats.inc(f"download_errors/{type(e).__name__}")
+                    if self.throttle is not None:
+                        self.throttle.on_error(request, e)
+                    raise
+                latency = time.monotonic() - start
+                # Selenium pages have no status code
+                status_code = getattr(response, 'status_code', None)
+                self.stats.observe('download_latency', latency)
+                self.stats.inc(f"response_status/{status_code if status_code is not None else 'rendered'}")
+                self.stats.inc('bytes_downloaded', getattr(response, 'num_bytes_downloaded', 0))
+                if self.throttle is not None:
+                    self.throttle.on_response(request, latency, status_code)
+                return response
+        finally:
+            self.politeness.release(request)
+
+    async def _fetch_with_cookies(self, request: StableRequest) -> StableResponse:
+        """Send the cookies of the request's session, unless it has its own Cookie header, and keep the new ones"""
+        headers = request.headers
+        cookie = None
+        if not any(key.lower() == 'cookie' for key in headers):
+            cookie = self.sessions.get_cookie_header(request)
+        if cookie is not None:
+            request.headers = {**headers, 'Cookie': cookie}
+        try:
+            response = await request.fetch(client=self.spider.http_client)
+        finally:
+            request.headers = headers
+        self.sessions.extract_cookies(request, response)
+        return response
+
+    async def close(self):
+        if self.http_cache is not None:
+            await self.http_cache.close()
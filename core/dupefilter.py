@@ -0,0 +1,164 @@
+import math
+import sys
+from typing import Callable, Dict, Optional
+
+
+class BaseSeenSet:
+    """Set of request fingerprints already seen, with hit rate metrics."""
+
+    def __init__(self):
+        self.checks = 0
+        self.hits = 0
+        # Called with every new fingerprint, e.g. to journal it
+        self.on_add: Optional[Callable[[bytes], None]] = None
+
+    def add(self, fingerprint: bytes) -> bool:
+        """
+        Record a fingerprint.
+
+        Returns:
+            True if the fingerprint had not been seen before.
+            False if it is a duplicate.
+        """
+        self.checks += 1
+        if fingerprint in self:
+            self.hits += 1
+            return False
+        self._add(fingerprint)
+        if self.on_add is not None:
+            self.on_add(fingerprint)
+        return True
+
+    def record(self, fingerprint: bytes) -> bool:
+        """Add a fingerprint without counting it as a check, e.g. for a request that skips the filter."""
+        if fingerprint in self:
+            return False
+        self._add(fingerprint)
+        if self.on_add is not None:
+            self.on_add(fingerprint)
+        return True
+
+    def restore(self, fingerprints):
+        """Add fingerprints from a checkpoint, without counting them as checks."""
+        for fingerprint in fingerprints:
+            self._add(fingerprint)
+
+    def _add(self, fingerprint: bytes):
+        raise NotImplementedError("Subclasses must implement _add method")
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        raise NotImplementedError("Subclasses must implement __contains__ method")
+
+    def __len__(self) -> int:
+        raise NotImplementedError("Subclasses must implement __len__ method")
+
+    def memory_usage(self) -> int:
+        """Approximate memory used by the fingerprints, in bytes."""
+        raise NotImplementedError("Subclasses must implement memory_usage method")
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.checks if self.checks else 0.0
+
+    def get_stats(self) -> Dict:
+        return {
+            'checks': self.checks,
+            'hits': self.hits,
+            'hit_rate': round(self.hit_rate, 4),
+            'size': len(self),
+            'memory': self.memory_usage(),
+        }
+
+
+class BloomSeenSet(BaseSeenSet):
+    def __init__(self, capacity: int = 10_000_000, error_rate: float = 0.001):
+        """
+        Bloom filter: fixed memory, at the cost of a false positive rate
+        (a new request is taken for a duplicate) of about error_rate up to capacity fingerprints.
+
+        Args:
+            capacity: expected number of fingerprints.
+            error_rate: false positive rate at capacity.
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._count = 0
+
+    def _positions(self, fingerprint: bytes):
+        # Double hashing; only the first 64 bits are used so that MemorySeenSet keys can be moved in
+        h1 = int.from_bytes(fingerprint[:8], 'big')
+        h2 = ((h1 * 0x9E3779B97F4A7C15) >> 64 ^ h1 >> 32) | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def _add(self, fingerprint: bytes):
+        for position in self._positions(fingerprint):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(fingerprint))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def memory_usage(self) -> int:
+        return len(self._bits)
+
+
+class MemorySeenSet(BaseSeenSet):
+    INT_SIZE = 36  # Size of a 64-bit int object
+
+    def __init__(self, max_memory: Optional[int] = None, error_rate: float = 0.001):
+        """
+        Exact set of 64-bit fingerprint prefixes, for small and medium crawls.
+
+        Args:
+            max_memory: memory bound in bytes. Once it is reached the fingerprints are moved into a
+                Bloom filter of the same size, which keeps memory flat from then on.
+            error_rate: false positive rate of that Bloom filter.
+        """
+        super().__init__()
+        self.max_memory = max_memory
+        self.error_rate = error_rate
+        self._set = set()
+        self._bloom: Optional[BloomSeenSet] = None
+
+    @staticmethod
+    def _key(fingerprint: bytes) -> int:
+        return int.from_bytes(fingerprint[:8], 'big')
+
+    def _add(self, fingerprint: bytes):
+        if self._bloom is not None:
+            self._bloom._add(fingerprint)
+            return
+
+        self._set.add(self._key(fingerprint))
+        if self.max_memory is not None and self.memory_usage() > self.max_memory:
+            self._to_bloom()
+
+    def _to_bloom(self):
+        """Move the fingerprints into a Bloom filter using max_memory bytes"""
+        capacity = int(self.max_memory * 8 * math.log(2) ** 2 / -math.log(self.error_rate))
+        bloom = BloomSeenSet(capacity=max(capacity, 1), error_rate=self.error_rate)
+        for key in self._set:
+            bloom._add(key.to_bytes(8, 'big'))
+        self._bloom = bloom
+        self._set = set()
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        if self._bloom is not None:
+            return fingerprint in self._bloom
+        return self._key(fingerprint) in self._set
+
+    def __len__(self) -> int:
+        return len(self._bloom) if self._bloom is not None else len(self._set)
+
+    def memory_usage(self) -> int:
+        if self._bloom is not None:
+            return self._bloom.memory_usage()
+        return sys.getsizeof(self._set) + len(self._set) * self.INT_SIZE
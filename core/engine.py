@@ -1,15 +1,47 @@
+import asyncio
+import inspect
 import traceback
+from contextvars import ContextVar
+from typing import Optional
 
+from core.checkpoint import JobDir
+from core.downloader import Downloader
+from core.frontier import BaseFrontier, DiskFrontier, FifoFrontier, FrontierQueue, LifoFrontier, PriorityFrontier
 from core.item import StableItem
-from core.schedule import Schedule
+from core.parallel import CallbackExecutor
+from core.pipeline import ItemPipeline
+from core.request import BaseRequest
+from core.schedule import DeferredRequest, Schedule
 from core.spider import Spider
+from core.stats import StatsCollector
+from utils.fingerprint import request_fingerprint
+
+# Journal id of the request a worker task is processing, each worker runs in its own context
+_processing_job_id: ContextVar[Optional[int]] = ContextVar('processing_job_id', default=None)
 
 
 class Engine:
+    CONCURRENCY = 16  # Default number of worker tasks
 
-    def __init__(self, spider: 'Spider'):
+    def __init__(self, spider: 'Spider', concurrency: Optional[int] = None, job_dir: Optional[str] = None):
+        """
+        Args:
+            spider: the spider to run.
+            concurrency: global number of worker tasks pulling requests from the shared queue,
+                defaults to Engine.CONCURRENCY. The number of requests in flight for the spider
+                is additionally bounded by Spider.CONCURRENT_REQUESTS.
+            job_dir: directory where the crawl state is checkpointed. If it holds the state of an
+                unfinished crawl, start() resumes it instead of running the start requests again.
+        """
         self.spider = spider
         self.spider_start = False
+        self.concurrency = concurrency if concurrency is not None else self.CONCURRENCY
+        # Crawl metrics, the counters are also checkpointed in the job directory
+        self.stats = StatsCollector.from_spider(spider)
+        self.job_dir = JobDir(job_dir, counters=self.stats.counters) if job_dir else None
+        self.downloader: Optional[Downloader] = None
+        # Tasks holding requests set aside until their host is available
+        self._deferred_tasks = set()
 
     async def start(self):
         spider = self.spider
@@ -20,25 +52,99 @@ class Engine:
         # Initialize request and item middleware instances
         request_middleware_instances, item_middleware_instances = self._init_middlewares()
 
+        # Items are queued for consumer tasks running the item middlewares
+        await self.stats.start()
+        item_pipeline = ItemPipeline(
+            spider=spider, item_middleware_instances=item_middleware_instances, stats=self.stats
+        )
+        item_pipeline.start()
+
         # Pass the request to the scheduler
-        schedule = Schedule(spider=spider, request_middleware_instances=request_middleware_instances)
+        self.downloader = Downloader(spider=spider, stats=self.stats)
+        callback_executor = CallbackExecutor(
+            spider=spider, threads=spider.CALLBACK_THREADS, processes=spider.CALLBACK_PROCESSES
+        )
+        schedule = Schedule(
+            spider=spider,
+            request_middleware_instances=request_middleware_instances,
+            downloader=self.downloader,
+            callback_executor=callback_executor,
+            stats=self.stats
+        )
 
-        # Process the spider's startup requests
-        async for request in spider.spider_start():
-            spider.logger.info(f"{spider.spider_name} loop starting request for URL: {request.url}")
+        # Requests yielded by callbacks are put back on this queue and picked up by the workers
+        frontier = self._init_frontier()
+        request_queue = FrontierQueue(frontier)
 
-            # Check if exit is required
-            if not self.spider_start:
-                break
+        # Resume the pending requests of an unfinished crawl
+        resumed = self._resume(request_queue)
 
-            try:
-                await self._handle_request_pipeline(request, schedule, item_middleware_instances)
-            except Exception:
-                spider.logger.error(traceback.format_exc())
-                spider.logger.error(f"{spider.spider_name} encountered an exception with request: {request.url}")
+        workers = [
+            asyncio.create_task(self._worker(request_queue, schedule, item_pipeline))
+            for _ in range(self.concurrency)
+        ]
+
+        finished = False
+        try:
+            # Feed the spider's startup requests
+            async for request in spider.spider_start(resume=resumed):
+                spider.logger.debug("%s loop starting request for URL: %s", spider.spider_name, request.url)
 
-        spider.logger.info(f"{spider.spider_name} spider finished")
-        await spider.spider_end()
+                # Check if exit is required
+                if not self.spider_start:
+                    break
+
+                # Start requests usually skip the filter, links back to them must still be filtered
+                if not request.need_request_filter:
+                    spider.seen_set.record(request_fingerprint(request))
+                self._enqueue(request_queue, request)
+
+            # Wait until every queued request, including those discovered by callbacks, is processed
+            await request_queue.join()
+            finished = self.spider_start
+        finally:
+            # Every step runs even when an earlier one fails, so that no resource is left open
+            loop = asyncio.get_running_loop()
+            await self._shutdown_step("stop the workers", self._cancel_tasks, workers + list(self._deferred_tasks))
+            await self._shutdown_step("close the frontier", frontier.close)
+            await self._shutdown_step(
+                "shut down the callback executor", loop.run_in_executor, None, callback_executor.shutdown
+            )
+            await self._shutdown_step("close the downloader", self.downloader.close)
+            if self.job_dir:
+                # Let the journal thread finish without blocking the event loop
+                await self._shutdown_step(
+                    "close the job directory", loop.run_in_executor, None, self.job_dir.close, finished
+                )
+            # Drain the item queue and save the items still buffered
+            await self._shutdown_step("save the remaining items", item_pipeline.close)
+            await self._shutdown_step("close the stats", self.stats.close)
+
+            if self.downloader.throttle is not None:
+                spider.logger.info(
+                    f"{spider.spider_name} autothrottle state: {self.downloader.throttle.get_state()}"
+                )
+            spider.logger.info(f"{spider.spider_name} spider finished")
+            await self._shutdown_step("end the spider", spider.spider_end)
+
+    async def _shutdown_step(self, description: str, func, *args):
+        """Run one step of the engine shutdown, a failure is logged and does not stop the next steps"""
+        try:
+            result = func(*args)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            self.spider.logger.exception(f"{self.spider.spider_name} failed to {description}")
+
+    @staticmethod
+    async def _cancel_tasks(tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        """Ask the engine to stop; queued requests are discarded by the workers."""
+        self.spider_start = False
 
     def _init_middlewares(self):
         """Initialize request and item middleware instances"""
@@ -51,26 +157,148 @@ class Engine:
         ]
         return request_middleware_instances, item_middleware_instances
 
-    async def _handle_request_pipeline(self, request, schedule, item_middleware_instances):
-        """Initiate the processing pipeline"""
+    def _resume(self, request_queue: FrontierQueue) -> bool:
+        """Restore the state found in the job directory, return whether a crawl was resumed"""
+        if not self.job_dir:
+            return False
+
         spider = self.spider
+        state = self.job_dir.load()
+        self.job_dir.start(state)
+        spider.seen_set.on_add = self._record_seen
+        if state is None:
+            return False
 
-        # Pass the request to the scheduler for processing
-        async for schedule_res in schedule.schedule(request):
-            # If the scheduler returns an item
-            if isinstance(schedule_res, StableItem):
-                stable_item = schedule_res
-                await self._process_item(stable_item, item_middleware_instances)
+        spider.seen_set.restore(bytes.fromhex(fingerprint) for fingerprint in state.seen)
+        self.stats.counters.update(state.counters)
+        for job_id, data in state.pending.items():
+            try:
+                request = BaseRequest.from_dict(data, spider=spider)
+            except ValueError as e:
+                spider.logger.error(f"{spider.spider_name} cannot restore request {data.get('url')}: {e}")
+                continue
+            # A request that passed the filter before the crash was journaled with need_request_filter unset,
+            # the others go through the filter again
+            request.job_id = job_id
+            request_queue.put_nowait(request)
+
+        spider.logger.info(
+            f"{spider.spider_name} resumed from {self.job_dir.path}: {len(state.pending)} pending requests, "
+            f"{len(state.seen)} fingerprints"
+        )
+        return True
+
+    def _record_seen(self, fingerprint: bytes):
+        """Journal a new fingerprint, along with the request being processed that it belongs to"""
+        self.job_dir.record_seen(fingerprint, job_id=_processing_job_id.get())
 
-    async def _process_item(self, item, item_middleware_instances):
+    def _enqueue(self, request_queue: FrontierQueue, request: BaseRequest):
+        """Put a new request on the queue, journaling it when checkpointing"""
+        self.stats.inc('requests_enqueued')
+        if self.job_dir:
+            self.job_dir.record_push(request)
+        request_queue.put_nowait(request)
+
+    def _init_frontier(self) -> BaseFrontier:
+        """Initialize the frontier selected by the spider's FRONTIER setting"""
         spider = self.spider
-        for middleware in item_middleware_instances:
-            spider.logger.info(
-                f"{spider.spider_name} Item middleware {middleware} processing: {item.url}"
-            )
-            item = await middleware.process_item(item)
-            if item is None:
-                spider.logger.info(
-                    f"{spider.spider_name} Item middleware {middleware} intercepted the item: {item.url}"
+        if spider.FRONTIER == 'priority':
+            return PriorityFrontier()
+        elif spider.FRONTIER == 'fifo':
+            return FifoFrontier()
+        elif spider.FRONTIER == 'lifo':
+            return LifoFrontier()
+        elif spider.FRONTIER == 'disk':
+            return DiskFrontier(spider=spider, path=spider.FRONTIER_PATH, memory_size=spider.FRONTIER_MEMORY_SIZE)
+        raise ValueError(f"Unknown frontier: {spider.FRONTIER}")
+
+    async def _worker(self, request_queue: FrontierQueue, schedule: Schedule, item_pipeline: ItemPipeline):
+        """Take requests from the shared queue until the engine cancels the worker"""
+        politeness = self.downloader.politeness
+        while True:
+            request = await request_queue.get()
+            deferred = False
+            try:
+                # Drain the queue without processing once the engine has been stopped
+                if not self.spider_start:
+                    continue
+
+                # Set the request aside while its host is busy, so the worker can serve other hosts
+                delay = politeness.defer_time(request)
+                if delay > 0:
+                    self._defer(request_queue, request, delay)
+                    deferred = True
+                    continue
+
+                # A cancelled request is neither counted nor journaled as done, it is fetched again on resume
+                _processing_job_id.set(request.job_id)
+                try:
+                    retry = await self._handle_request_pipeline(request, schedule, request_queue, item_pipeline)
+                finally:
+                    _processing_job_id.set(None)
+
+                # A retried request stays pending in the journal
+                if retry is None:
+                    self._record_processed(request)
+                # Retries wait on the side like deferred requests, without holding the worker
+                else:
+                    retry.request.job_id = request.job_id
+                    self.stats.inc('requests_retried')
+                    self._defer(request_queue, retry.request, retry.delay, undefer=False)
+                    deferred = True
+            except Exception:
+                self.stats.inc('requests_failed')
+                self.spider.logger.error(traceback.format_exc())
+                self.spider.logger.error(
+                    f"{self.spider.spider_name} encountered an exception with request: {request.url}"
                 )
-                break
+                self._record_processed(request)
+            finally:
+                # A deferred request stays unfinished until it is put back on the queue
+                if not deferred:
+                    request_queue.task_done()
+
+    def _record_processed(self, request: BaseRequest):
+        """Count a request as processed and journal it as done"""
+        self.stats.inc('requests_processed')
+        if self.job_dir:
+            self.job_dir.record_done(request)
+
+    def _defer(self, request_queue: FrontierQueue, request: BaseRequest, delay: float, undefer: bool = True):
+        """Put the request back on the queue after the delay, undefer it from its host's slot if it was counted"""
+        async def requeue():
+            await asyncio.sleep(delay)
+            if undefer:
+                self.downloader.politeness.undefer(request)
+            request_queue.put_nowait(request)
+            request_queue.task_done()
+
+        task = asyncio.create_task(requeue())
+        self._deferred_tasks.add(task)
+        task.add_done_callback(self._deferred_tasks.discard)
+
+    async def _handle_request_pipeline(
+            self, request, schedule, request_queue, item_pipeline
+    ) -> Optional[DeferredRequest]:
+        """
+        Process one request; new requests go back on the queue, items go through the item middlewares.
+
+        Returns:
+            - DeferredRequest: the request has to be retried after a delay.
+            - None: the request has been processed.
+        """
+        retry = None
+        # Pass the request to the scheduler for processing
+        async for schedule_res in schedule.process_request(request):
+            # If the scheduler returns a new request
+            if isinstance(schedule_res, BaseRequest):
+                self._enqueue(request_queue, schedule_res)
+            # If the scheduler asks for a retry
+            elif isinstance(schedule_res, DeferredRequest):
+                retry = schedule_res
+            # If the scheduler returns an item
+            elif isinstance(schedule_res, StableItem):
+                stable_item = schedule_res
+                self.stats.inc('items_scraped')
+                await item_pipeline.put(stable_item)
+        return retry
@@ -0,0 +1,175 @@
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Pattern, Type, Union
+
+from lxml import etree
+from parsel import Selector
+from parsel.csstranslator import HTMLTranslator
+from parsel.utils import extract_regex
+
+from core.item import StableItem
+from core.response import StableResponse
+
+# Namespaces available in the expressions, the same as with Selector.xpath()
+DEFAULT_NAMESPACES = {
+    're': 'http://exslt.org/regular-expressions',
+    'set': 'http://exslt.org/sets',
+}
+
+_css_translator = HTMLTranslator()
+
+
+class Field:
+    def __init__(
+            self,
+            xpath: Optional[str] = None,
+            css: Optional[str] = None,
+            re: Optional[Union[str, Pattern]] = None,
+            many: bool = False,
+            default: Any = None,
+            processor: Optional[Callable[[Any], Any]] = None
+    ):
+        """
+        How one field of an item is extracted from a page.
+
+        Args:
+            xpath: XPath selecting the value(s), e.g. '//h1/text()'.
+            css: CSS selector, with parsel's ::text and ::attr(name) pseudo-elements, instead of xpath.
+            re: regex applied to the selected strings, or to the whole page if neither xpath nor css is given.
+                Like Selector.re(), it yields the group named 'extract', else the groups, else the whole match.
+            many: keep all the values as a list instead of the first one.
+            default: value of the field when nothing matches, with many=False.
+            processor: applied to each value, e.g. str.strip or int.
+        """
+        if xpath is not None and css is not None:
+            raise ValueError("A field takes either xpath or css, not both")
+        if xpath is None and css is None and re is None:
+            raise ValueError("A field needs an xpath, a css or a re")
+        self.xpath = xpath
+        self.css = css
+        self.re = re
+        self.many = many
+        self.default = default
+        self.processor = processor
+
+    def get_xpath(self) -> Optional[str]:
+        if self.css is not None:
+            return _css_translator.css_to_xpath(self.css)
+        return self.xpath
+
+
+class _CompiledField:
+    __slots__ = ('name', 'field', 'xpath', 're')
+
+    def __init__(self, name: str, field: Field, namespaces: Dict[str, str]):
+        """A field with its expressions compiled, once per Extractor."""
+        self.name = name
+        self.field = field
+        xpath = field.get_xpath()
+        self.xpath = etree.XPath(xpath, namespaces=namespaces, smart_strings=False) if xpath is not None else None
+        self.re = re.compile(field.re) if field.re is not None else None
+
+
+class Extractor:
+    def __init__(
+            self,
+            item_cls: Type[StableItem],
+            fields: Dict[str, Union[Field, str]],
+            namespaces: Optional[Dict[str, str]] = None
+    ):
+        """
+        Extracts items of one StableItem subclass from pages, with expressions compiled once.
+
+        Callbacks calling response.xpath('...') get the query compiled again on every page; an Extractor
+        compiles each XPath and CSS selector (translated to XPath) when it is built, usually as a spider
+        class attribute, and evaluates them on the parsed document the response caches.
+
+            class ProductSpider(Spider):
+                product = Extractor(Product, {
+                    'name': '//h1/text()',
+                    'price': Field(css='.price::text', re=r'[\\d.]+', processor=float),
+                    'tags': Field(css='.tag::text', many=True),
+                })
+
+                async def parse(self, response, meta):
+                    yield self.product.extract(response)
+
+        Args:
+            item_cls: the model the extracted values are validated into.
+            fields: field name to Field, or to an XPath string for a plain Field(xpath=...).
+            namespaces: prefixes usable in the expressions, in addition to re: and set: (EXSLT).
+        """
+        self.item_cls = item_cls
+        unknown = set(fields) - set(item_cls.model_fields)
+        if unknown:
+            raise ValueError(f"{item_cls.__name__} has no field {', '.join(sorted(unknown))}")
+        self.namespaces = {**DEFAULT_NAMESPACES, **(namespaces or {})}
+        self._fields: List[_CompiledField] = [
+            _CompiledField(name, field if isinstance(field, Field) else Field(xpath=field), self.namespaces)
+            for name, field in fields.items()
+        ]
+
+    @staticmethod
+    def _get_values(compiled: _CompiledField, root, text: Callable[[], str]) -> List[Any]:
+        if compiled.xpath is not None:
+            result = compiled.xpath(root)
+            if not isinstance(result, list):
+                # count(), boolean() and string() give a single value
+                result = [result]
+            values = [
+                etree.tostring(value, method='html', encoding='unicode', with_tail=False)
+                if isinstance(value, etree._Element) else value
+                for value in result
+            ]
+        else:
+            values = [text()]
+        if compiled.re is not None:
+            values = [
+                match for value in values if isinstance(value, str) for match in extract_regex(compiled.re, value)
+            ]
+        return values
+
+    def extract_fields(self, response: Union[StableResponse, Selector]) -> Dict[str, Any]:
+        """Values of the fields found in a response or a selector, not validated"""
+        selector = response.selector if isinstance(response, StableResponse) else response
+        root = selector.root
+        text_cache: List[str] = []
+
+        def text() -> str:
+            if not text_cache:
+                try:
+                    text_cache.append(response.text)
+                except AttributeError:
+                    # Selenium page or bare selector: serialize the document
+                    text_cache.append(selector.get())
+            return text_cache[0]
+
+        values = {}
+        for compiled in self._fields:
+            field = compiled.field
+            found = self._get_values(compiled, root, text)
+            if not field.many:
+                found = found[:1]
+            if field.processor is not None:
+                found = [field.processor(value) for value in found]
+            if field.many:
+                values[compiled.name] = found
+            elif found:
+                values[compiled.name] = found[0]
+            elif field.default is not None:
+                values[compiled.name] = field.default
+        return values
+
+    def extract(self, response: Union[StableResponse, Selector]) -> StableItem:
+        """
+        The item found in a response.
+
+        Fields with no match and no default are left out, so the model's own defaults apply; a required one
+        makes pydantic raise a ValidationError.
+        """
+        return self.item_cls(**self.extract_fields(response))
+
+    def extract_all(self, responses: Iterable[Union[StableResponse, Selector]]) -> List[StableItem]:
+        """The items found in several responses, e.g. the pages gathered by a callback"""
+        item_cls = self.item_cls
+        extract_fields = self.extract_fields
+        return [item_cls(**extract_fields(response)) for response in responses]
@@ -0,0 +1,212 @@
+import asyncio
+import heapq
+import itertools
+import json
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+from core.request import BaseRequest
+from utils.serialization import json_default, json_object_hook
+
+
+class BaseFrontier:
+    """Pending requests of a crawl, the order in which they are taken is up to the implementation."""
+
+    # Called for every request a frontier drops instead of returning it from pop()
+    on_drop: Optional[Callable[[], None]] = None
+
+    def push(self, request: BaseRequest):
+        raise NotImplementedError("Subclasses must implement push method")
+
+    def pop(self) -> BaseRequest:
+        raise NotImplementedError("Subclasses must implement pop method")
+
+    def __len__(self) -> int:
+        raise NotImplementedError("Subclasses must implement __len__ method")
+
+    def close(self):
+        pass
+
+
+class PriorityFrontier(BaseFrontier):
+    """Heap-based frontier, higher priority first and FIFO among requests of the same priority."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def push(self, request: BaseRequest):
+        heapq.heappush(self._heap, (-request.priority, next(self._counter), request))
+
+    def pop(self) -> BaseRequest:
+        return heapq.heappop(self._heap)[-1]
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class FifoFrontier(BaseFrontier):
+    """First in, first out: breadth-first crawl order, priorities are ignored."""
+
+    def __init__(self):
+        self._queue = deque()
+
+    def push(self, request: BaseRequest):
+        self._queue.append(request)
+
+    def pop(self) -> BaseRequest:
+        return self._queue.popleft()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+
+class LifoFrontier(FifoFrontier):
+    """Last in, first out: depth-first crawl order, priorities are ignored."""
+
+    def pop(self) -> BaseRequest:
+        return self._queue.pop()
+
+
+class DiskFrontier(PriorityFrontier):
+    def __init__(self, spider, path: Optional[str] = None, memory_size: int = 10000):
+        """
+        Priority frontier keeping at most memory_size requests in memory and paging the rest out
+        to an anonymous JSON lines file.
+
+        Requests paged out to disk are read back in the order they were written once the in-memory
+        window is empty, so priorities only apply within the window. A request that cannot be
+        serialized stays in memory, a record that cannot be read back is logged and dropped.
+
+        Args:
+            spider: the spider whose callbacks the paged-in requests are bound to.
+            path: directory of the spill file, defaults to ./frontier. The file is private to the
+                frontier and removed when it is closed.
+            memory_size: maximum number of requests kept in memory.
+        """
+        super().__init__()
+        self.spider = spider
+        self.memory_size = memory_size
+        self.path = Path(path) if path else Path('./frontier')
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._file = tempfile.TemporaryFile(dir=self.path, prefix=f"{spider.spider_name}-", suffix='.jsonl')
+        self._read_offset = 0
+        self._on_disk = 0
+
+    def push(self, request: BaseRequest):
+        if len(self._heap) < self.memory_size and not self._on_disk:
+            super().push(request)
+            return
+
+        try:
+            line = json.dumps(request.to_dict(), default=json_default).encode('utf-8') + b'\n'
+        except (TypeError, ValueError) as e:
+            self.spider.logger.warning(
+                f"{self.spider.spider_name} cannot page out request {request.url}, keeping it in memory: {e}"
+            )
+            super().push(request)
+            return
+
+        # Writes always go to the end of the file, reads keep their own offset
+        self._file.seek(0, 2)
+        self._file.write(line)
+        self._on_disk += 1
+
+    def pop(self) -> BaseRequest:
+        # Every record of a window may have been dropped
+        while not self._heap and self._on_disk:
+            self._page_in()
+        return super().pop()
+
+    def __len__(self) -> int:
+        return len(self._heap) + self._on_disk
+
+    def _page_in(self):
+        """Load the next window of requests from disk"""
+        self._file.flush()
+        self._file.seek(self._read_offset)
+        for _ in range(min(self.memory_size, self._on_disk)):
+            line = self._file.readline()
+            self._on_disk -= 1
+            try:
+                data = json.loads(line, object_hook=json_object_hook)
+                request = BaseRequest.from_dict(data, spider=self.spider)
+            except (TypeError, ValueError, KeyError) as e:
+                self.spider.logger.error(f"{self.spider.spider_name} dropped a paged out request: {e}")
+                if self.on_drop is not None:
+                    self.on_drop()
+                continue
+            super().push(request)
+        self._read_offset = self._file.tell()
+
+        # Everything has been read back, start over with an empty file
+        if not self._on_disk:
+            self._file.seek(0)
+            self._file.truncate()
+            self._read_offset = 0
+
+    def close(self):
+        # The anonymous file is deleted when it is closed
+        self._file.close()
+
+
+class FrontierQueue:
+    def __init__(self, frontier: BaseFrontier):
+        """
+        Queue of the pending requests over a frontier, with the get()/task_done()/join() semantics of
+        asyncio.Queue for the workers. Unbounded, put_nowait() never blocks.
+
+        Args:
+            frontier: holds the queued requests and decides their order.
+        """
+        self.frontier = frontier
+        # A dropped request will never be taken, it is finished right away so that join() returns
+        frontier.on_drop = self.task_done
+        self._unfinished_tasks = 0
+        self._not_empty = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def qsize(self) -> int:
+        return len(self.frontier)
+
+    def empty(self) -> bool:
+        return not len(self.frontier)
+
+    def put_nowait(self, request: BaseRequest):
+        self.frontier.push(request)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._not_empty.set()
+
+    async def get(self) -> BaseRequest:
+        """Take the next request, waiting while the frontier is empty"""
+        while True:
+            while self.empty():
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            try:
+                return self.frontier.pop()
+            except IndexError:
+                # The frontier dropped the requests it counted, wait for the next ones
+                continue
+
+    def task_done(self):
+        """Mark a request taken by get() as processed"""
+        if self._unfinished_tasks <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished_tasks -= 1
+        if self._unfinished_tasks == 0:
+            self._finished.set()
+
+    async def join(self):
+        """Wait until every request put on the queue has been processed"""
+        await self._finished.wait()
+
+    def __repr__(self) -> str:
+        return (
+            f"<{type(self).__name__} frontier={type(self.frontier).__name__}[{len(self.frontier)}] "
+            f"tasks={self._unfinished_tasks}>"
+        )
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Literal, Optional, Tuple
+
+import httpx
+
+from core.request import BaseRequest, StableRequest
+from core.response import StableResponse
+from utils.fingerprint import request_fingerprint
+
+# Describe the body as it was sent, not as it is stored (decoded)
+_TRANSPORT_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+class HttpCacheMiss(Exception):
+    def __init__(self, url: str):
+        """A request has no cached response while the cache is in replay mode."""
+        super().__init__(f"No cached response for {url}")
+        self.url = url
+
+
+class CacheEntry:
+    def __init__(self, fingerprint: bytes, url: str, status_code: int, headers: List[Tuple[str, str]], body: bytes,
+                 stored_at: float):
+        """A response stored in the cache, with its decoded body."""
+        self.fingerprint = fingerprint
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    def get_header(self, name: str) -> Optional[str]:
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+
+class HttpCache:
+    def __init__(
+            self,
+            path: str,
+            ttl: Optional[float] = 0,
+            max_size: Optional[int] = None,
+            mode: Literal['normal', 'replay'] = 'normal',
+            http_codes: FrozenSet[int] = frozenset({200, 203, 301, 308, 404, 410})
+    ):
+        """
+        On-disk HTTP cache of StableRequest responses, stored in a SQLite database.
+
+        A cached response younger than ttl is served without any download. An older one is revalidated:
+        the request is sent with If-None-Match/If-Modified-Since built from its ETag/Last-Modified, and a
+        304 answer is served from the cache.
+
+        Args:
+            path: the SQLite database file.
+            ttl: seconds a response is served without revalidation, 0 to always revalidate, None to never.
+            max_size: total size of the cached bodies in bytes beyond which the least recently used
+                responses are evicted, None for no limit.
+            mode: 'replay' serves every request from the cache whatever its age, and raises HttpCacheMiss
+                for requests it does not hold, without ever downloading anything.
+            http_codes: status codes of the responses stored.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.mode = mode
+        self.http_codes = http_codes
+        # SQLite calls are blocking: they run one at a time in a dedicated thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='httpcache')
+        self._connection: Optional[sqlite3.Connection] = None
+        self._size = 0
+
+    @classmethod
+    def from_spider(cls, spider) -> 'HttpCache':
+        return cls(
+            path=spider.HTTPCACHE_PATH or str(Path('./httpcache') / f"{spider.spider_name}.sqlite3"),
+            ttl=spider.HTTPCACHE_TTL,
+            max_size=spider.HTTPCACHE_MAX_SIZE,
+            mode=spider.HTTPCACHE_MODE,
+            http_codes=spider.HTTPCACHE_HTTP_CODES,
+        )
+
+    @property
+    def replay(self) -> bool:
+        return self.mode == 'replay'
+
+    @staticmethod
+    def is_cacheable(request: BaseRequest) -> bool:
+        """GET requests whose body is read at once, unless meta['dont_cache'] is set"""
+        return (
+            isinstance(request, StableRequest)
+            and request.method.upper() == 'GET'
+            and request.save_to is None
+            and not request.iter_chunks
+            and not request.meta.get('dont_cache')
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'fingerprint BLOB PRIMARY KEY, url TEXT, status_code INTEGER, headers TEXT, body BLOB, '
+                'size INTEGER, stored_at REAL, accessed_at REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+            self._size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            self._connection = connection
+            # The limit may have been lowered since the last crawl
+            if self.max_size is not None and self._size > self.max_size:
+                self._evict()
+        return self._connection
+
+    def _get(self, fingerprint: bytes) -> Optional[CacheEntry]:
+        connection = self._connect()
+        row = connection.execute(
+            'SELECT url, status_code, headers, body, stored_at FROM responses WHERE fingerprint = ?', (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None
+        with connection:
+            connection.execute(
+                'UPDATE responses SET accessed_at = ? WHERE fingerprint = ?', (time.time(), fingerprint)
+            )
+        url, status_code, headers, body, stored_at = row
+        return CacheEntry(fingerprint, url, status_code, [tuple(pair) for pair in json.loads(headers)], body,
+                          stored_at)
+
+    def _put(self, entry: CacheEntry):
+        connection = self._connect()
+        with connection:
+            row = connection.execute(
+                'SELECT size FROM responses WHERE fingerprint = ?', (entry.fingerprint,)
+            ).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (entry.fingerprint, entry.url, entry.status_code, json.dumps(entry.headers), entry.body,
+                 len(entry.body), entry.stored_at, time.time())
+            )
+        self._size += len(entry.body) - (row[0] if row else 0)
+        if self.max_size is not None and self._size > self.max_size:
+            self._evict()
+
+    def _touch(self, fingerprint: bytes, headers: List[Tuple[str, str]], stored_at: float):
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                'UPDATE responses SET headers = ?, stored_at = ? WHERE fingerprint = ?',
+                (json.dumps(headers), stored_at, fingerprint)
+            )
+
+    def _evict(self):
+        """Delete the least recently used responses, down to 90% of max_size so that eviction is not run per write"""
+        connection = self._connect()
+        target = self.max_size * 0.9
+        with connection:
+            while self._size > target:
+                rows = connection.execute(
+                    'SELECT fingerprint, size FROM responses ORDER BY accessed_at LIMIT 100'
+                ).fetchall()
+                if not rows:
+                    break
+                evicted = []
+                for fingerprint, size in rows:
+                    if self._size <= target:
+                        break
+                    evicted.append((fingerprint,))
+                    self._size -= size
+                connection.executemany('DELETE FROM responses WHERE fingerprint = ?', evicted)
+
+    async def get(self, request: BaseRequest) -> Optional[CacheEntry]:
+        return await self._run(self._get, request_fingerprint(request))
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        if self.replay or self.ttl is None:
+            return True
+        return time.time() - entry.stored_at < self.ttl
+
+    @staticmethod
+    def get_validators(entry: Optional[CacheEntry]) -> Dict[str, str]:
+        """Headers making the request conditional on the cached response having changed"""
+        validators = {}
+        if entry is None:
+            return validators
+        etag = entry.get_header('etag')
+        if etag:
+            validators['If-None-Match'] = etag
+        last_modified = entry.get_header('last-modified')
+        if last_modified:
+            validators['If-Modified-Since'] = last_modified
+        elif not etag:
+            validators['If-Modified-Since'] = formatdate(entry.stored_at, usegmt=True)
+        return validators
+
+    async def store(self, request: BaseRequest, response: StableResponse) -> bool:
+        """Store the response if it is cacheable, return whether it was stored"""
+        # Selenium pages have no status code and are not cached
+        if getattr(response, 'status_code', None) not in self.http_codes or response.truncated:
+            return False
+        if 'no-store' in response.headers.get('cache-control', '').lower():
+            return False
+        # A body larger than the whole cache would only evict everything else
+        if self.max_size is not None and len(response.content) > self.max_size:
+            return False
+        entry = CacheEntry(
+            fingerprint=request_fingerprint(request),
+            url=str(response.url),
+            status_code=response.status_code,
+            headers=self._get_headers(response.headers),
+            body=response.content,
+            stored_at=time.time(),
+        )
+        await self._run(self._put, entry)
+        return True
+
+    async def refresh(self, entry: CacheEntry, response: StableResponse):
+        """Mark a cached response as valid again after a 304, with the headers sent along"""
+        headers = dict((key.lower(), (key, value)) for key, value in entry.headers)
+        for key, value in self._get_headers(response.headers):
+            headers[key.lower()] = (key, value)
+        entry.headers = list(headers.values())
+        entry.stored_at = time.time()
+        await self._run(self._touch, entry.fingerprint, entry.headers, entry.stored_at)
+
+    @staticmethod
+    def _get_headers(headers: httpx.Headers) -> List[Tuple[str, str]]:
+        return [(key, value) for key, value in headers.multi_items() if key.lower() not in _TRANSPORT_HEADERS]
+
+    @staticmethod
+    def to_response(entry: CacheEntry, request: BaseRequest) -> StableResponse:
+        response = httpx.Response(
+            status_code=entry.status_code,
+            headers=entry.headers,
+            content=entry.body,
+            request=httpx.Request(request.method, entry.url),
+        )
+        return StableResponse(response=response, request=request, from_cache=True)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown()
@@ -0,0 +1,158 @@
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Union
+from urllib.parse import parse_qsl, urlsplit
+
+from core.response import StableResponse
+from utils.selenium_driver import RenderProfile, SeleniumDriver, SeleniumDriverPool
+
+# Found in the pages served instead of the content to clients that do not run JavaScript
+DEFAULT_CHALLENGE_MARKERS = (
+    'cf-browser-verification',
+    'cf_chl_opt',
+    '<title>Just a moment...</title>',
+    'Enable JavaScript and cookies to continue',
+    'Please enable JavaScript',
+    'You need to enable JavaScript to run this app',
+)
+
+
+class BrowserDetector:
+    def __init__(
+            self,
+            required_xpath: Optional[str] = None,
+            min_body_size: int = 0,
+            challenge_markers: Iterable[str] = DEFAULT_CHALLENGE_MARKERS,
+            statuses: FrozenSet[int] = frozenset(),
+            scan_size: int = 64 * 1024
+    ):
+        """
+        Tells whether a page fetched over plain HTTP lacks content that only a browser would get.
+
+        Args:
+            required_xpath: XPath that must match in a complete page, e.g. the element holding the data.
+            min_body_size: smallest complete body, in bytes.
+            challenge_markers: strings of bot challenge or "enable JavaScript" pages, matched without case.
+            statuses: status codes answered to clients that are not browsers, e.g. {403}.
+            scan_size: bytes at the start of the body searched for the markers.
+        """
+        self.required_xpath = required_xpath
+        self.min_body_size = min_body_size
+        self.challenge_markers = [marker.lower().encode('utf-8') for marker in challenge_markers]
+        self.statuses = statuses
+        self.scan_size = scan_size
+
+    def check(self, response: StableResponse) -> Optional[str]:
+        """Why the page needs the browser, None if the plain HTTP page is fine"""
+        if response.status_code in self.statuses:
+            return f"status {response.status_code}"
+        body = response.content
+        if len(body) < self.min_body_size:
+            return f"body of {len(body)} bytes"
+        head = body[:self.scan_size].lower()
+        for marker in self.challenge_markers:
+            if marker in head:
+                return f"challenge marker {marker.decode('utf-8')!r}"
+        if self.required_xpath is not None and not response.xpath(self.required_xpath):
+            return f"no match for {self.required_xpath}"
+        return None
+
+
+class RouteStats:
+    __slots__ = ('http_success', 'http_attempts', 'browser_fetches', 'since_probe')
+
+    def __init__(self):
+        """How the pages of a URL pattern were fetched so far."""
+        self.http_success: Optional[float] = None  # Moving average of the plain HTTP attempts that were fine
+        self.http_attempts = 0
+        self.browser_fetches = 0
+        self.since_probe = 0  # Requests sent straight to the browser since the last HTTP probe
+
+
+class HybridRouter:
+    def __init__(
+            self,
+            driver: Union[SeleniumDriver, SeleniumDriverPool],
+            detector: Optional[BrowserDetector] = None,
+            render_profile: Optional[RenderProfile] = None,
+            url_patterns: Optional[List[str]] = None,
+            min_attempts: int = 3,
+            success_threshold: float = 0.5,
+            probe_interval: int = 50,
+            smoothing: float = 0.3
+    ):
+        """
+        Routes StableHybridRequests either to plain HTTP or to the browser, learning per URL pattern.
+
+        Pages are fetched over HTTP and checked by the detector; the failing ones are rendered by the
+        browser. Once the HTTP pages of a pattern mostly fail, its requests go straight to the browser,
+        except one in probe_interval that tries HTTP again, in case the site changed.
+
+        Args:
+            driver: renders the pages that need a browser, preferably the spider's driver pool.
+            detector: checks the plain HTTP pages, BrowserDetector() if omitted.
+            render_profile: how pages are rendered, None for the driver's own profile.
+            url_patterns: regexes grouping URLs, the first one matching a URL is its pattern. URLs matching
+                none are grouped by host and path, with the segments holding digits generalized.
+            min_attempts: HTTP attempts of a pattern before its pages may go straight to the browser.
+            success_threshold: share of fine HTTP pages below which a pattern goes to the browser.
+            probe_interval: browser fetches of a pattern between two HTTP attempts.
+            smoothing: weight of the latest attempt in the moving average of fine HTTP pages.
+        """
+        self.driver = driver
+        self.detector = detector if detector is not None else BrowserDetector()
+        self.render_profile = render_profile
+        self.url_patterns = [re.compile(pattern) for pattern in url_patterns or ()]
+        self.min_attempts = min_attempts
+        self.success_threshold = success_threshold
+        self.probe_interval = probe_interval
+        self.smoothing = smoothing
+        self.routes: Dict[str, RouteStats] = {}
+
+    def get_pattern(self, url: str) -> str:
+        for pattern in self.url_patterns:
+            if pattern.search(url):
+                return pattern.pattern
+        parts = urlsplit(url)
+        path = '/'.join('{id}' if any(c.isdigit() for c in segment) else segment for segment in parts.path.split('/'))
+        query = '&'.join(sorted({key for key, _ in parse_qsl(parts.query, keep_blank_values=True)}))
+        return f"{parts.hostname}{path}?{query}" if query else f"{parts.hostname}{path}"
+
+    def get_route(self, url: str) -> RouteStats:
+        pattern = self.get_pattern(url)
+        route = self.routes.get(pattern)
+        if route is None:
+            route = self.routes[pattern] = RouteStats()
+        return route
+
+    def use_browser(self, url: str) -> bool:
+        """Whether to skip plain HTTP for this URL"""
+        route = self.get_route(url)
+        if route.http_attempts < self.min_attempts or route.http_success >= self.success_threshold:
+            return False
+        # Counted when the route is decided, so that concurrent requests do not all take the same probe slot
+        if route.since_probe >= self.probe_interval:
+            route.since_probe = 0
+            return False
+        route.since_probe += 1
+        return True
+
+    def record_http(self, url: str, success: bool):
+        route = self.get_route(url)
+        route.http_attempts += 1
+        if route.http_success is None:
+            route.http_success = float(success)
+        else:
+            route.http_success += self.smoothing * (float(success) - route.http_success)
+
+    def record_browser(self, url: str):
+        self.get_route(url).browser_fetches += 1
+
+    def get_state(self) -> Dict[str, Dict]:
+        return {
+            pattern: {
+                'http_success': route.http_success,
+                'http_attempts': route.http_attempts,
+                'browser_fetches': route.browser_fetches,
+            }
+            for pattern, route in self.routes.items()
+        }
@@ -0,0 +1,172 @@
+import asyncio
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Literal, Optional, Tuple
+
+import httpx
+
+from core.request import BaseRequest, StableRequest
+from core.response import StableResponse
+
+# Headers describing the encoding of the body on the wire, which the snapshot body no longer has
+_TRANSPORT_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+def cpu_bound(executor: Literal['thread', 'process'] = 'process'):
+    """
+    Mark a callback as CPU-bound so that the scheduler runs it off the event loop.
+
+    In 'thread' mode the callback runs in a thread pool with the real response.
+    In 'process' mode it runs in a process pool on a ResponseSnapshot, on a bare instance of the
+    spider class: class attributes are available, the state set up in __init__ (logger, HTTP client,
+    drivers...) is not. The requests it yields must use spider methods as callbacks. Worker processes are
+    spawned, not forked: the spider class and the callback must be importable at module level, not defined
+    inside a function, and the main script must guard its entry point with `if __name__ == '__main__':`.
+
+    The callback should be a plain function or generator; async callbacks run on a private event loop.
+
+        @cpu_bound('process')
+        def parse(self, response, meta):
+            ...
+    """
+    def decorator(func):
+        func.__stable_executor__ = executor
+        return func
+
+    return decorator
+
+
+class ResponseSnapshot:
+    def __init__(self, url: str, method: str, status_code: int, headers: List[Tuple[str, str]], body: bytes,
+                 meta: Dict):
+        """Picklable copy of a response, sent to the worker processes."""
+        self.url = url
+        self.method = method
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.meta = meta
+
+    @classmethod
+    def from_response(cls, response: StableResponse, meta: Dict) -> 'ResponseSnapshot':
+        try:
+            status_code = response.status_code
+        except AttributeError:
+            # Selenium page: only the rendered document is available
+            return cls(
+                url=response.request.url,
+                method='GET',
+                status_code=200,
+                headers=[('content-type', 'text/html; charset=utf-8')],
+                body=response.selector.get().encode('utf-8'),
+                meta=meta,
+            )
+
+        headers = [
+            (key, value) for key, value in response.headers.multi_items() if key.lower() not in _TRANSPORT_HEADERS
+        ]
+        return cls(
+            url=str(response.url),
+            method=response.request.method if response.request is not None else 'GET',
+            status_code=status_code,
+            headers=headers,
+            body=response.content,
+            meta=meta,
+        )
+
+    def to_response(self) -> StableResponse:
+        response = httpx.Response(
+            status_code=self.status_code,
+            headers=self.headers,
+            content=self.body,
+            request=httpx.Request(self.method, self.url),
+        )
+        request = StableRequest(url=self.url, method=self.method, meta=self.meta)
+        return StableResponse(response=response, request=request)
+
+
+def _collect(callback: Callable, response: StableResponse, meta: Dict) -> List:
+    """Call the callback and gather everything it returns or yields"""
+    if inspect.isasyncgenfunction(callback):
+        async def gather():
+            return [res async for res in callback(response=response, meta=meta)]
+
+        return asyncio.run(gather())
+    elif asyncio.iscoroutinefunction(callback):
+        results = asyncio.run(callback(response=response, meta=meta))
+    else:
+        results = callback(response=response, meta=meta)
+
+    if inspect.isgenerator(results):
+        return list(results)
+    return [results]
+
+
+def _run_in_process(spider_class: type, callback, snapshot: ResponseSnapshot) -> List:
+    """Worker process side: run the callback on the snapshot, requests are sent back serialized"""
+    if isinstance(callback, str):
+        callback = getattr(spider_class.__new__(spider_class), callback)
+    results = _collect(callback, snapshot.to_response(), snapshot.meta)
+    return [('request', res.to_dict()) if isinstance(res, BaseRequest) else ('result', res) for res in results]
+
+
+class CallbackExecutor:
+    def __init__(self, spider, threads: Optional[int] = None, processes: Optional[int] = None):
+        """
+        Run CPU-bound callbacks in a thread or process pool, created on first use.
+
+        Args:
+            spider: the spider the callbacks belong to.
+            threads: size of the thread pool, defaults to the executor's default.
+            processes: size of the process pool, defaults to the number of CPUs.
+        """
+        self.spider = spider
+        self.threads = threads
+        self.processes = processes or os.cpu_count()
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    @staticmethod
+    def get_mode(callback: Callable) -> Optional[str]:
+        """The executor a callback was marked for with cpu_bound(), None for the event loop"""
+        return getattr(callback, '__stable_executor__', None)
+
+    async def run(self, callback: Callable, response: StableResponse, meta: Dict) -> List:
+        loop = asyncio.get_running_loop()
+        if self.get_mode(callback) == 'thread':
+            return await loop.run_in_executor(self._get_thread_pool(), partial(_collect, callback, response, meta))
+
+        # Spider methods are sent by name, the spider instance itself cannot be pickled
+        if inspect.ismethod(callback) and callback.__self__ is self.spider:
+            callback = callback.__name__
+        snapshot = ResponseSnapshot.from_response(response, meta)
+        results = await loop.run_in_executor(
+            self._get_process_pool(), _run_in_process, type(self.spider), callback, snapshot
+        )
+        return [
+            BaseRequest.from_dict(res, spider=self.spider) if kind == 'request' else res for kind, res in results
+        ]
+
+    def _get_thread_pool(self) -> Executor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='callback')
+        return self._thread_pool
+
+    def _get_process_pool(self) -> Executor:
+        if self._process_pool is None:
+            # Forking would copy locks held by the engine's threads (logging, journal, cache), workers are spawned
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._process_pool
+
+    def shutdown(self):
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown()
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
@@ -0,0 +1,173 @@
+import asyncio
+import time
+from typing import Awaitable, Dict, List, Optional
+
+from core.item import StableItem
+from core.spider import Spider
+from core.stats import StatsCollector
+from middlewares.item_middleware import ItemMiddleware
+
+
+class ItemPipeline:
+    def __init__(self, spider: 'Spider', item_middleware_instances: List[ItemMiddleware],
+                 queue_size: Optional[int] = None, consumers: Optional[int] = None,
+                 stats: Optional[StatsCollector] = None):
+        """
+        Run items through the item middlewares in order, apart from the download workers.
+
+        Items are put on a bounded queue drained by consumer tasks, so downloads go on while items are saved;
+        once the queue is full, put() waits, which keeps a slow sink from piling items up in memory.
+
+        Middlewares implementing save_items() are batched: each item goes through clean_item() and into the
+        middleware's buffer, which is saved with one save_items() call when it holds BATCH_SIZE items, when its
+        oldest item is BATCH_INTERVAL seconds old, or when the pipeline is closed. The saved items then continue
+        to the next middlewares. A batch whose save_items() raises is logged and counted as items_dropped.
+
+        Args:
+            spider: the spider the items come from.
+            item_middleware_instances: the item middlewares, in order.
+            queue_size: maximum number of queued items, defaults to spider.ITEM_QUEUE_SIZE.
+            consumers: number of consumer tasks, defaults to spider.ITEM_CONSUMERS.
+            stats: collects the latency and outcomes of each middleware.
+        """
+        self.spider = spider
+        self.item_middleware_instances = item_middleware_instances
+        self.queue_size = queue_size if queue_size is not None else spider.ITEM_QUEUE_SIZE
+        self.consumers = consumers if consumers is not None else spider.ITEM_CONSUMERS
+        self.stats = stats if stats is not None else StatsCollector(spider=spider, log_interval=None)
+        # Metric label of each middleware
+        self._labels = [
+            f"{index}:{type(middleware).__name__}" for index, middleware in enumerate(item_middleware_instances)
+        ]
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer_tasks: List[asyncio.Task] = []
+        self._buffers: Dict[int, List[StableItem]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._buffered_at: Dict[int, Optional[float]] = {}
+        for index, middleware in enumerate(item_middleware_instances):
+            if middleware.is_batching():
+                self._buffers[index] = []
+                self._locks[index] = asyncio.Lock()
+                self._buffered_at[index] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the consumers and the time based flushes"""
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._consumer_tasks = [asyncio.create_task(self._consume()) for _ in range(self.consumers)]
+        if self._buffers and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def put(self, item: StableItem):
+        """Queue an item for the middlewares, waiting while the queue is full"""
+        await self._queue.put(item)
+
+    async def _consume(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self.process_item(item)
+            except Exception:
+                self.spider.logger.exception(f"{self.spider.spider_name} failed to process an item")
+            finally:
+                self._queue.task_done()
+
+    async def _timed(self, index: int, awaitable: Awaitable):
+        label = self._labels[index]
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        except Exception:
+            self.stats.inc(f"item_outcome/{label}:error")
+            raise
+        finally:
+            self.stats.observe(f"item_middleware_latency/{label}", time.perf_counter() - start)
+
+    async def process_item(self, item: StableItem, start: int = 0):
+        spider = self.spider
+        middlewares = self.item_middleware_instances
+        for index in range(start, len(middlewares)):
+            middleware = middlewares[index]
+            spider.logger.debug("%s Item middleware %s processing item", spider.spider_name, middleware)
+
+            if index in self._buffers:
+                item = await self._timed(index, middleware.clean_item(item))
+                if item is not None:
+                    self.stats.inc(f"item_outcome/{self._labels[index]}:buffered")
+                    await self._buffer(index, item)
+                    return
+            else:
+                item = await self._timed(index, middleware.process_item(item))
+
+            if item is None:
+                self.stats.inc(f"item_outcome/{self._labels[index]}:dropped")
+                spider.logger.debug("%s Item middleware %s intercepted the item", spider.spider_name, middleware)
+                return
+            self.stats.inc(f"item_outcome/{self._labels[index]}:passed")
+
+    async def _buffer(self, index: int, item: StableItem):
+        middleware = self.item_middleware_instances[index]
+        async with self._locks[index]:
+            buffer = self._buffers[index]
+            buffer.append(item)
+            if self._buffered_at[index] is None:
+                self._buffered_at[index] = time.monotonic()
+            full = len(buffer) >= middleware.BATCH_SIZE
+        if full:
+            await self.flush(index)
+
+    async def flush(self, index: int):
+        """Save the buffered batch of a middleware and pass the saved items on"""
+        middleware = self.item_middleware_instances[index]
+        async with self._locks[index]:
+            batch = self._buffers[index]
+            if not batch:
+                return
+            self._buffers[index] = []
+            self._buffered_at[index] = None
+            self.spider.logger.debug(
+                "%s Item middleware %s saving %d items", self.spider.spider_name, middleware, len(batch)
+            )
+            try:
+                saved_items = await self._timed(index, middleware.save_items(batch))
+            except Exception:
+                # The batch is not retried, its loss shows in the crawl stats
+                self.stats.inc('items_dropped', len(batch))
+                raise
+            self.stats.inc(f"item_outcome/{self._labels[index]}:saved", len(batch))
+
+        for saved_item in saved_items or []:
+            if saved_item is not None:
+                await self.process_item(saved_item, start=index + 1)
+
+    async def _flush_loop(self):
+        interval = min(self.item_middleware_instances[index].BATCH_INTERVAL for index in self._buffers)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for index in self._buffers:
+                buffered_at = self._buffered_at[index]
+                if buffered_at is not None and now - buffered_at >= self.item_middleware_instances[index].BATCH_INTERVAL:
+                    try:
+                        await self.flush(index)
+                    except Exception:
+                        self.spider.logger.exception(f"{self.spider.spider_name} failed to save a batch of items")
+
+    async def close(self):
+        """Process the queued items, then save what is left in the buffers, in middleware order"""
+        if self._queue is not None:
+            await self._queue.join()
+        tasks = self._consumer_tasks
+        if self._flush_task is not None:
+            tasks = tasks + [self._flush_task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._consumer_tasks = []
+        self._flush_task = None
+
+        for index in sorted(self._buffers):
+            try:
+                await self.flush(index)
+            except Exception:
+                self.spider.logger.exception(f"{self.spider.spider_name} failed to save a batch of items")
@@ -0,0 +1,126 @@
+import asyncio
+import random
+import time
+from typing import Dict
+
+from core.request import BaseRequest
+
+
+class DomainSlot:
+    def __init__(self, delay: float, jitter: float, concurrency: int):
+        """
+        Politeness state of a single host.
+
+        Args:
+            delay: minimum interval between two requests sent to the host.
+            jitter: additional random range added to the delay.
+            concurrency: maximum number of requests in flight to the host.
+        """
+        self.delay = delay
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.last_hit = 0.0  # time.monotonic() of the last request sent to the host
+        self.next_allowed = 0.0  # time.monotonic() from which the next request may be sent
+        self.deferred = 0  # Requests set aside by the engine until the host is available
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a new request may be sent to the host, 0 if it may be sent now."""
+        if self.in_flight >= self.concurrency:
+            return max(self.next_allowed - now, Politeness.POLL_INTERVAL)
+        return max(self.next_allowed - now, 0.0)
+
+
+class Politeness:
+    POLL_INTERVAL = 0.1  # Seconds between checks while a host has no free concurrency
+
+    def __init__(
+            self,
+            delay: float = 3,
+            jitter: float = 5,
+            concurrency_per_domain: int = 1,
+            max_deferred_per_domain: int = 8
+    ):
+        """
+        Per-domain politeness: requests to the same host are spaced apart and their number in flight
+        is bounded, while requests to an idle host go out immediately.
+
+        Args:
+            delay: default minimum interval between two requests to the same host.
+            jitter: default additional random range added to the delay.
+            concurrency_per_domain: default maximum number of requests in flight per host.
+            max_deferred_per_domain: maximum number of requests per host the engine may set aside
+                while the host is busy; further requests wait for the host in acquire().
+        """
+        self.delay = delay
+        self.jitter = jitter
+        self.concurrency_per_domain = concurrency_per_domain
+        self.max_deferred_per_domain = max_deferred_per_domain
+        self.slots: Dict[str, DomainSlot] = {}
+
+    @staticmethod
+    def get_domain(request: BaseRequest) -> str:
+        return request.domain
+
+    def get_slot(self, request: BaseRequest) -> DomainSlot:
+        domain = self.get_domain(request)
+        slot = self.slots.get(domain)
+        if slot is None:
+            slot = DomainSlot(delay=self.delay, jitter=self.jitter, concurrency=self.concurrency_per_domain)
+            self.slots[domain] = slot
+        return slot
+
+    def defer_time(self, request: BaseRequest) -> float:
+        """
+        Seconds the request should be set aside before being processed, 0 if it should be processed now.
+
+        Only a bounded number of requests per host are set aside; each one must be handed back
+        with undefer() once it is put back in the queue.
+        """
+        slot = self.get_slot(request)
+        wait = slot.wait_time(time.monotonic())
+        if wait <= 0 or slot.deferred >= self.max_deferred_per_domain:
+            return 0.0
+        slot.deferred += 1
+        return wait
+
+    def undefer(self, request: BaseRequest):
+        self.get_slot(request).deferred -= 1
+
+    async def acquire(self, request: BaseRequest):
+        """Wait until the request's host is available and reserve a place for the request."""
+        slot = self.get_slot(request)
+        while True:
+            now = time.monotonic()
+            wait = slot.wait_time(now)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+
+        slot.in_flight += 1
+        slot.last_hit = now
+        slot.next_allowed = now + self._interval(slot, request)
+
+    def release(self, request: BaseRequest):
+        self.get_slot(request).in_flight -= 1
+
+    @staticmethod
+    def _interval(slot: DomainSlot, request: BaseRequest) -> float:
+        """Interval before the next request to the host, requests may override the host's defaults."""
+        delay = slot.delay if request.request_interval_time is None else request.request_interval_time
+        jitter = slot.jitter if request.request_interval_time_random_range is None \
+            else request.request_interval_time_random_range
+        return delay + random.uniform(0, jitter)
+
+    def get_state(self) -> Dict:
+        """Current per-domain state, for monitoring."""
+        return {
+            domain: {
+                'delay': slot.delay,
+                'jitter': slot.jitter,
+                'concurrency': slot.concurrency,
+                'in_flight': slot.in_flight,
+                'last_hit': slot.last_hit,
+            }
+            for domain, slot in self.slots.items()
+        }
@@ -1,14 +1,27 @@
-import random
+import os
+import sys
 import asyncio
-from typing import Callable, Optional, Dict, List, Literal
+import functools
+from typing import Callable, Optional, Dict, List, Literal, Tuple, Union
+from urllib.parse import urlsplit
 
 import httpx
 
+from core.hybrid import HybridRouter
 from core.response import StableResponse
-from utils.retry import async_retry
+from utils.selenium_driver import RenderProfile, SeleniumDriver, SeleniumDriverPool
+
+_slot_names: Dict[type, Tuple[str, ...]] = {}
 
 
 class BaseRequest:
+    # Millions of requests may wait in the frontier: no per-instance __dict__, see also headers and meta
+    __slots__ = (
+        '_url', '_domain', 'method', 'callback', 'data', 'json', 'params', 'cookies', '_headers', '_meta',
+        'need_request_filter', 'need_response_filter', 'timeout', 'request_interval_time',
+        'request_interval_time_random_range', 'priority', 'job_id', 'retry_times',
+    )
+
     def __init__(
             self,
             url: str,
@@ -23,8 +36,9 @@ class BaseRequest:
             need_request_filter: bool = True,
             need_response_filter: bool = True,
             timeout: int = 10,
-            request_interval_time: int = 3,
-            request_interval_time_random_range: int = 5
+            request_interval_time: Optional[float] = None,
+            request_interval_time_random_range: Optional[float] = None,
+            priority: int = 0
     ):
         """
         Common initialization parameters:
@@ -35,8 +49,11 @@ class BaseRequest:
             meta: used to pass custom data
             need_request_filter/need_response_filter: whether filtering is needed
             timeout: request timeout duration
-            request_interval_time: base time interval between requests
-            request_interval_time_random_range: additional random range for the request interval
+            request_interval_time: base time interval before the next request to the same host,
+                None to use the spider's DOWNLOAD_DELAY
+            request_interval_time_random_range: additional random range for the request interval,
+                None to use the spider's DOWNLOAD_DELAY_JITTER
+            priority: requests with a higher priority are taken from the frontier first
         """
         self.url = url
         self.method = method
@@ -45,49 +62,345 @@ class BaseRequest:
         self.json = json
         self.params = params
         self.cookies = cookies
-        self.headers = headers if headers is not None else {}
-        self.meta = meta if meta is not None else {}
+        # Allocated on first access, most requests have neither
+        self._headers: Optional[Dict] = headers
+        self._meta: Optional[Dict] = meta
         self.need_request_filter = need_request_filter
         self.need_response_filter = need_response_filter
         self.timeout = timeout
         self.request_interval_time = request_interval_time
         self.request_interval_time_random_range = request_interval_time_random_range
+        self.priority = priority
+        self.job_id: Optional[int] = None  # Identifier of the request in the crawl journal, if any
+        self.retry_times = 0  # Number of times the download has been retried
 
-    async def random_sleep(self):
-        delay = random.randint(
-            self.request_interval_time,
-            self.request_interval_time + self.request_interval_time_random_range
-        )
-        await asyncio.sleep(delay)
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @url.setter
+    def url(self, url: str):
+        self._url = url
+        self._domain = None
+
+    @property
+    def domain(self) -> str:
+        """Host of the URL, parsed once and interned so that the requests to a host share one string"""
+        if self._domain is None:
+            self._domain = sys.intern(urlsplit(self._url).hostname or '')
+        return self._domain
+
+    @property
+    def headers(self) -> Dict:
+        if self._headers is None:
+            self._headers = {}
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers: Optional[Dict]):
+        self._headers = headers
+
+    @property
+    def meta(self) -> Dict:
+        if self._meta is None:
+            self._meta = {}
+        return self._meta
+
+    @meta.setter
+    def meta(self, meta: Optional[Dict]):
+        self._meta = meta
+
+    def replace(self, **kwargs) -> 'BaseRequest':
+        """
+        Copy of the request with some attributes changed, e.g. request.replace(url=new_url, priority=10).
+
+        headers and meta are copied, so that changing them does not affect the original request. job_id and
+        retry_times are reset: the copy is a new request for the crawl.
+        """
+        cls = type(self)
+        request = cls.__new__(cls)
+        for name in self._get_slot_names(cls):
+            setattr(request, name, getattr(self, name))
+        # Subclasses without __slots__ of their own have a __dict__
+        if hasattr(self, '__dict__'):
+            request.__dict__.update(self.__dict__)
+        request._headers = dict(self._headers) if self._headers is not None else None
+        request._meta = dict(self._meta) if self._meta is not None else None
+        request.job_id = None
+        request.retry_times = 0
+        for name, value in kwargs.items():
+            if not hasattr(request, name):
+                raise TypeError(f"{cls.__name__} has no attribute {name}")
+            setattr(request, name, value)
+        return request
+
+    def copy(self) -> 'BaseRequest':
+        return self.replace()
+
+    @staticmethod
+    def _get_slot_names(cls: type) -> Tuple[str, ...]:
+        names = _slot_names.get(cls)
+        if names is None:
+            names = tuple(
+                name for klass in cls.__mro__ for name in getattr(klass, '__slots__', ())
+                if name not in ('__dict__', '__weakref__')
+            )
+            _slot_names[cls] = names
+        return names
 
-    async def fetch(self) -> StableResponse:
-        """Abstract method, implement the specific request logic in subclasses."""
+    def to_dict(self) -> Dict:
+        """
+        Serializable representation of the request.
+
+        The callback is stored by name and looked up on the spider again by from_dict().
+        """
+        callback = self.callback
+        if callback is not None and not isinstance(callback, str):
+            callback = callback.__name__
+        return {
+            'type': type(self).__name__,
+            'url': self.url,
+            'method': self.method,
+            'callback': callback,
+            'data': self.data,
+            'json': self.json,
+            'params': self.params,
+            'cookies': self.cookies,
+            'headers': self._headers,
+            'meta': self._meta,
+            'need_request_filter': self.need_request_filter,
+            'need_response_filter': self.need_response_filter,
+            'timeout': self.timeout,
+            'request_interval_time': self.request_interval_time,
+            'request_interval_time_random_range': self.request_interval_time_random_range,
+            'priority': self.priority,
+            'job_id': self.job_id,
+            'retry_times': self.retry_times,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, spider=None) -> 'BaseRequest':
+        """
+        Rebuild a request serialized by to_dict().
+
+        Args:
+            data: the serialized request.
+            spider: the spider the callback is looked up on.
+        """
+        data = dict(data)
+        request_type = data.pop('type', cls.__name__)
+        if request_type != cls.__name__:
+            return cls._get_request_class(request_type).from_dict(data, spider=spider)
+
+        callback = data.get('callback')
+        if isinstance(callback, str):
+            if spider is None or not hasattr(spider, callback):
+                raise ValueError(f"Callback {callback} cannot be found on spider {spider}")
+            data['callback'] = getattr(spider, callback)
+
+        job_id = data.pop('job_id', None)
+        retry_times = data.pop('retry_times', 0)
+        request = cls(**data)
+        request.job_id = job_id
+        request.retry_times = retry_times
+        return request
+
+    @staticmethod
+    def _get_request_class(name: str) -> type:
+        request_classes = [BaseRequest]
+        while request_classes:
+            request_class = request_classes.pop()
+            if request_class.__name__ == name:
+                return request_class
+            request_classes.extend(request_class.__subclasses__())
+        raise ValueError(f"Unknown request type: {name}")
+
+    async def fetch(self, client: Optional[httpx.AsyncClient] = None) -> StableResponse:
+        """
+        Abstract method, implement the specific request logic in subclasses.
+
+        Args:
+            client: the shared HTTP client injected by the scheduler, if any.
+        """
         raise NotImplementedError("Subclasses must implement fetch method")
 
 
 class StableRequest(BaseRequest):
-    @async_retry()
-    async def fetch(self) -> StableResponse:
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            # Control the request rate
-            await self.random_sleep()
-            response = await client.request(
+    __slots__ = ('max_body_size', 'body_size_exceeded', 'save_to', 'iter_chunks')
+
+    def __init__(
+            self,
+            url: str,
+            method: Literal['GET', 'POST'] = 'GET',
+            callback: Optional[Callable] = None,
+            data=None,
+            json=None,
+            params=None,
+            cookies=None,
+            headers: Optional[Dict] = None,
+            meta: Optional[Dict] = None,
+            need_request_filter: bool = True,
+            need_response_filter: bool = True,
+            timeout: int = 10,
+            request_interval_time: Optional[float] = None,
+            request_interval_time_random_range: Optional[float] = None,
+            priority: int = 0,
+            max_body_size: Optional[int] = None,
+            body_size_exceeded: Literal['abort', 'truncate'] = 'abort',
+            save_to: Optional[str] = None,
+            iter_chunks: bool = False
+    ):
+        """
+        Setting any of max_body_size, save_to or iter_chunks streams the body instead of reading it at once.
+
+        max_body_size: largest decoded body in bytes, None for the spider's DOWNLOAD_MAXSIZE.
+        body_size_exceeded: 'abort' raises BodySizeExceeded on larger bodies, 'truncate' keeps their
+            first max_body_size bytes and sets response.truncated.
+        save_to: file the body is written to as it arrives, given to the callback as response.file_path.
+        iter_chunks: hand the callback a response whose body is not read yet, to consume with
+            `async for chunk in response.iter_chunks()`; it is closed once the callback is done.
+        """
+        super().__init__(
+            url=url,
+            method=method,
+            callback=callback,
+            data=data,
+            json=json,
+            params=params,
+            cookies=cookies,
+            headers=headers,
+            meta=meta,
+            need_request_filter=need_request_filter,
+            need_response_filter=need_response_filter,
+            timeout=timeout,
+            request_interval_time=request_interval_time,
+            request_interval_time_random_range=request_interval_time_random_range,
+            priority=priority
+        )
+        self.max_body_size = max_body_size
+        self.body_size_exceeded = body_size_exceeded
+        self.save_to = save_to
+        self.iter_chunks = iter_chunks
+
+    def to_dict(self) -> Dict:
+        data = super().to_dict()
+        data.update(
+            max_body_size=self.max_body_size,
+            body_size_exceeded=self.body_size_exceeded,
+            save_to=self.save_to,
+            iter_chunks=self.iter_chunks,
+        )
+        return data
+
+    @property
+    def is_streaming(self) -> bool:
+        return self.max_body_size is not None or self.save_to is not None or self.iter_chunks
+
+    async def fetch(self, client: Optional[httpx.AsyncClient] = None) -> StableResponse:
+        if self.is_streaming:
+            return await self._stream(client)
+        # Reuse the spider's pooled client when one is injected
+        if client is not None:
+            response = await self._send(client)
+        else:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await self._send(client)
+        return StableResponse(response=response, request=self)
+
+    async def _send(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.request(
+            method=self.method,
+            url=self.url,
+            params=self.params,
+            data=self.data,
+            json=self.json,
+            headers=self._headers,
+            cookies=self.cookies,
+            timeout=self.timeout
+        )
+
+    async def _stream(self, client: Optional[httpx.AsyncClient] = None) -> StableResponse:
+        """Send the request and read the body chunk by chunk, capped at max_body_size"""
+        owned_client = None
+        if client is None:
+            client = owned_client = httpx.AsyncClient(timeout=self.timeout)
+        try:
+            request = client.build_request(
                 method=self.method,
                 url=self.url,
                 params=self.params,
                 data=self.data,
                 json=self.json,
-                headers=self.headers,
-                cookies=self.cookies
+                headers=self._headers,
+                cookies=self.cookies,
+                timeout=self.timeout
             )
-        return StableResponse(response=response, request=self)
+            response = await client.send(request, stream=True)
+        except BaseException:
+            if owned_client is not None:
+                await owned_client.aclose()
+            raise
+
+        # The callback reads the body, the scheduler closes the response (and its client) afterwards
+        stable_response = StableResponse(response=response, request=self, client=owned_client)
+        if self.iter_chunks:
+            return stable_response
+
+        try:
+            if self.save_to is not None:
+                await self._save_body(stable_response)
+                body = b''
+            else:
+                body = b''.join([chunk async for chunk in stable_response.iter_chunks()])
+        finally:
+            await stable_response.aclose()
+        # A regular response holding the body as read, already decoded and possibly truncated
+        headers = [
+            (key, value) for key, value in response.headers.multi_items()
+            if key.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')
+        ]
+        read_response = httpx.Response(
+            status_code=response.status_code,
+            headers=headers,
+            content=body,
+            request=response.request,
+            extensions=response.extensions,
+        )
+        return StableResponse(
+            response=read_response,
+            request=self,
+            file_path=stable_response.file_path,
+            truncated=stable_response.truncated,
+            num_bytes_downloaded=response.num_bytes_downloaded,
+        )
+
+    async def _save_body(self, response: StableResponse):
+        """Write the body to save_to, through a temporary file so that a failed download leaves no partial file"""
+        loop = asyncio.get_running_loop()
+        part_path = f"{self.save_to}.part"
+        directory = os.path.dirname(self.save_to)
+        if directory:
+            await loop.run_in_executor(None, functools.partial(os.makedirs, directory, exist_ok=True))
+        f = await loop.run_in_executor(None, open, part_path, 'wb')
+        try:
+            async for chunk in response.iter_chunks():
+                await loop.run_in_executor(None, f.write, chunk)
+        except BaseException:
+            await loop.run_in_executor(None, f.close)
+            await loop.run_in_executor(None, os.remove, part_path)
+            raise
+        await loop.run_in_executor(None, f.close)
+        await loop.run_in_executor(None, os.replace, part_path, self.save_to)
+        response.file_path = self.save_to
 
 
 class StableSeleniumRequest(BaseRequest):
+    __slots__ = ('driver', 'render_profile')
+
     def __init__(
             self,
             url: str,
-            driver,
+            driver: Union[SeleniumDriver, SeleniumDriverPool],
             method: Literal['GET'] = 'GET',
             callback: Optional[Callable] = None,
             data=None,
@@ -99,9 +412,15 @@ class StableSeleniumRequest(BaseRequest):
             need_request_filter: bool = True,
             need_response_filter: bool = True,
             timeout: int = 10,
-            request_interval_time: int = 3,
-            request_interval_time_random_range: int = 5
+            request_interval_time: Optional[float] = None,
+            request_interval_time_random_range: Optional[float] = None,
+            priority: int = 0,
+            render_profile: Optional[RenderProfile] = None
     ):
+        """
+        render_profile: how the page is rendered (resource blocking, element to wait for),
+            None for the driver's own profile.
+        """
         super().__init__(
             url=url,
             method=method,
@@ -116,12 +435,120 @@ class StableSeleniumRequest(BaseRequest):
             need_response_filter=need_response_filter,
             timeout=timeout,
             request_interval_time=request_interval_time,
-            request_interval_time_random_range=request_interval_time_random_range
+            request_interval_time_random_range=request_interval_time_random_range,
+            priority=priority
         )
         self.driver = driver
+        self.render_profile = render_profile
+
+    def to_dict(self) -> Dict:
+        data = super().to_dict()
+        data['render_profile'] = self.render_profile.to_dict() if self.render_profile is not None else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict, spider=None) -> 'StableSeleniumRequest':
+        # The driver is not serialized, use the spider's pool, or its single driver
+        data = dict(data)
+        data.setdefault('driver', getattr(spider, 'driver_pool', None) or getattr(spider, 'driver', None))
+        if isinstance(data.get('render_profile'), dict):
+            data['render_profile'] = RenderProfile.from_dict(data['render_profile'])
+        return super().from_dict(data, spider=spider)
 
-    async def fetch(self) -> StableResponse:
-        # Control the request rate
-        await self.random_sleep()
-        selector = self.driver.get(self.url)
+    async def fetch(self, client: Optional[httpx.AsyncClient] = None) -> StableResponse:
+        # WebDriver calls are blocking, they run in a thread so the event loop keeps going
+        if isinstance(self.driver, SeleniumDriverPool):
+            async with self.driver.checkout() as driver:
+                selector = await self.driver.run(self._get, driver)
+        else:
+            selector = await asyncio.get_running_loop().run_in_executor(None, self._get, self.driver)
         return StableResponse(selector=selector, request=self)
+
+    def _get(self, driver: SeleniumDriver):
+        with driver.lock:
+            return driver.get(self.url, render_profile=self.render_profile)
+
+
+class StableHybridRequest(StableRequest):
+    __slots__ = ('router',)
+
+    def __init__(
+            self,
+            url: str,
+            router: HybridRouter,
+            method: Literal['GET', 'POST'] = 'GET',
+            callback: Optional[Callable] = None,
+            data=None,
+            json=None,
+            params=None,
+            cookies=None,
+            headers: Optional[Dict] = None,
+            meta: Optional[Dict] = None,
+            need_request_filter: bool = True,
+            need_response_filter: bool = True,
+            timeout: int = 10,
+            request_interval_time: Optional[float] = None,
+            request_interval_time_random_range: Optional[float] = None,
+            priority: int = 0,
+            max_body_size: Optional[int] = None,
+            body_size_exceeded: Literal['abort', 'truncate'] = 'abort'
+    ):
+        """
+        Fetched over plain HTTP, and rendered by the router's browser only when the router's detector finds
+        the page incomplete, or when the pages of the same URL pattern usually are. The browser loads the URL
+        with a GET, without the request's headers, cookies or body.
+
+        router: the spider's HybridRouter, e.g. SeleniumSpider.hybrid_router.
+        """
+        super().__init__(
+            url=url,
+            method=method,
+            callback=callback,
+            data=data,
+            json=json,
+            params=params,
+            cookies=cookies,
+            headers=headers,
+            meta=meta,
+            need_request_filter=need_request_filter,
+            need_response_filter=need_response_filter,
+            timeout=timeout,
+            request_interval_time=request_interval_time,
+            request_interval_time_random_range=request_interval_time_random_range,
+            priority=priority,
+            max_body_size=max_body_size,
+            body_size_exceeded=body_size_exceeded
+        )
+        self.router = router
+
+    def to_dict(self) -> Dict:
+        data = super().to_dict()
+        # Bodies are always read at once, the page is checked by the detector
+        for key in ('save_to', 'iter_chunks'):
+            data.pop(key)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict, spider=None) -> 'StableHybridRequest':
+        # The router is not serialized, use the spider's one
+        data = dict(data)
+        data.setdefault('router', getattr(spider, 'hybrid_router', None))
+        return super().from_dict(data, spider=spider)
+
+    async def fetch(self, client: Optional[httpx.AsyncClient] = None) -> StableResponse:
+        router = self.router
+        if not router.use_browser(self.url):
+            response = await super().fetch(client)
+            success = router.detector.check(response) is None
+            router.record_http(self.url, success)
+            if success:
+                return response
+
+        router.record_browser(self.url)
+        browser_request = StableSeleniumRequest(
+            url=self.url, driver=router.driver, timeout=self.timeout, render_profile=router.render_profile
+        )
+        response = await browser_request.fetch()
+        response.request = self
+        return response
+
@@ -1,14 +1,55 @@
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
-from httpx import Response
-from parsel import Selector
+from httpx import AsyncClient, Response
+from parsel import Selector, SelectorList
+
+_UNSET = object()
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class BodySizeExceeded(Exception):
+    def __init__(self, url: str, max_body_size: int):
+        """The body of a streamed response is larger than the request's max_body_size."""
+        super().__init__(f"Response body of {url} exceeds {max_body_size} bytes")
+        self.url = url
+        self.max_body_size = max_body_size
 
 
 class StableResponse:
-    def __init__(self, response: 'Response' = None, request=None, selector=None):
+    def __init__(
+            self,
+            response: 'Response' = None,
+            request=None,
+            selector=None,
+            file_path: Optional[str] = None,
+            truncated: bool = False,
+            client: Optional[AsyncClient] = None,
+            from_cache: bool = False,
+            num_bytes_downloaded: Optional[int] = None
+    ):
+        """
+        Args:
+            response: the underlying httpx response, still open if the request has iter_chunks set.
+            request: the request the response answers.
+            selector: an already parsed document, e.g. a Selenium page.
+            file_path: where the body was written, for requests with save_to set; the body is then empty.
+            truncated: whether the body was cut at the request's max_body_size.
+            client: a client owned by the response, closed along with it.
+            from_cache: whether the response was served from the HTTP cache.
+            num_bytes_downloaded: bytes received for a body read before this response was built, defaults to
+                the underlying response's count.
+        """
         self._response: Response = response
         self.request = request
-        self.selector = selector
+        # Parsed lazily and kept for the lifetime of the response, see release()
+        self._selector: Optional[Selector] = selector
+        self._json = _UNSET
+        self.file_path = file_path
+        self.truncated = truncated
+        self._client = client
+        self.from_cache = from_cache
+        self._num_bytes_downloaded = num_bytes_downloaded
 
     @classmethod
     def parser_html(cls, html):
@@ -20,12 +61,92 @@ class StableResponse:
         """Parse the response content using lxml if an underlying response exists."""
         if not self._response:
             raise ValueError("No response to parse")
-        return Selector(text=self._response.text)
+        return Selector(text=self.text)
+
+    @property
+    def selector(self) -> Selector:
+        """The parsed document, built on first access and shared by xpath/css/re/jmespath."""
+        if self._selector is None:
+            self._selector = self.parser_response()
+        return self._selector
+
+    @selector.setter
+    def selector(self, selector: Optional[Selector]):
+        self._selector = selector
 
-    def xpath(self, xpath_query: str):
+    def xpath(self, xpath_query: str, **kwargs) -> SelectorList:
         """Unified XPath query interface."""
-        sel = self.selector if self.selector is not None else self.parser_response()
-        return sel.xpath(xpath_query)
+        return self.selector.xpath(xpath_query, **kwargs)
+
+    def css(self, css_query: str) -> SelectorList:
+        """CSS query on the cached document."""
+        return self.selector.css(css_query)
+
+    def re(self, regex, replace_entities: bool = True) -> List[str]:
+        """Regular expression over the cached document."""
+        return self.selector.re(regex, replace_entities=replace_entities)
+
+    def jmespath(self, query: str, **kwargs) -> SelectorList:
+        """JMESPath query on the cached document, for JSON responses."""
+        return self.selector.jmespath(query, **kwargs)
+
+    def release(self):
+        """
+        Drop the parsed document and parsed JSON to free memory early.
+
+        They are built again on next access, except for a selector given at construction
+        (e.g. a Selenium page), which is gone for good.
+        """
+        self._selector = None
+        self._json = _UNSET
+
+    @property
+    def num_bytes_downloaded(self) -> int:
+        """Bytes received from the network for the body, before decompression."""
+        if self._num_bytes_downloaded is not None:
+            return self._num_bytes_downloaded
+        if self._response is not None:
+            return self._response.num_bytes_downloaded
+        return 0
+
+    async def iter_chunks(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """
+        Iterate over the decoded body of a streamed response, without keeping it in memory.
+
+        The body is capped at the request's max_body_size: beyond it, BodySizeExceeded is raised, or the
+        iteration stops and truncated is set if the request's body_size_exceeded is 'truncate'.
+
+        Args:
+            chunk_size: size of the chunks read from the network.
+        """
+        max_body_size = getattr(self.request, 'max_body_size', None)
+        truncate = getattr(self.request, 'body_size_exceeded', 'abort') == 'truncate'
+        if max_body_size is not None and not truncate:
+            # Give up before downloading anything when the server announces a larger body
+            content_length = self._response.headers.get('content-length', '')
+            if content_length.isdigit() and int(content_length) > max_body_size:
+                raise BodySizeExceeded(str(self._response.url), max_body_size)
+
+        size = 0
+        async for chunk in self._response.aiter_bytes(chunk_size):
+            if max_body_size is not None and size + len(chunk) > max_body_size:
+                if not truncate:
+                    raise BodySizeExceeded(str(self._response.url), max_body_size)
+                self.truncated = True
+                chunk = chunk[:max_body_size - size]
+                if chunk:
+                    yield chunk
+                return
+            size += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        """Close a streamed response before its body has been read, no-op otherwise."""
+        if self._response is not None and not self._response.is_closed:
+            await self._response.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     @property
     def status_code(self) -> int:
@@ -36,15 +157,17 @@ class StableResponse:
 
     @property
     def text(self) -> str:
-        """Directly retrieve the response text."""
+        """Directly retrieve the response text (httpx decodes it once and caches it)."""
         if self._response is not None:
             return self._response.text
         raise AttributeError("No underlying response available")
 
     def json(self):
-        """Parse the response as JSON."""
+        """Parse the response as JSON, once."""
         if self._response is not None:
-            return self._response.json()
+            if self._json is _UNSET:
+                self._json = self._response.json()
+            return self._json
         raise AttributeError("No underlying response available")
 
     def __getattr__(self, item):
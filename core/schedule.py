@@ -1,63 +1,202 @@
 import asyncio
+import heapq
 import inspect
+import itertools
+import time
 from typing import Optional, Union, AsyncGenerator, List
 
+from core.downloader import Downloader
+from core.frontier import PriorityFrontier
 from core.item import StableItem
+from core.parallel import CallbackExecutor
 from core.request import BaseRequest
 from core.response import StableResponse
 from core.spider import Spider
+from core.stats import StatsCollector
+from utils.retry import RetryPolicy
+
+
+class DeferredRequest:
+    def __init__(self, request: BaseRequest, delay: float):
+        """A request to process again once the delay has passed, e.g. a retry."""
+        self.request = request
+        self.delay = delay
 
 
 class Schedule:
-    def __init__(self, spider: 'Spider', request_middleware_instances: List):
+    def __init__(
+            self,
+            spider: 'Spider',
+            request_middleware_instances: List,
+            downloader: Optional[Downloader] = None,
+            callback_executor: Optional[CallbackExecutor] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            stats: Optional[StatsCollector] = None
+    ):
         self.spider = spider
         self.request_middleware_instances = request_middleware_instances
+        self.downloader = downloader if downloader is not None else Downloader(spider=spider)
+        self.callback_executor = callback_executor if callback_executor is not None else CallbackExecutor(
+            spider=spider, threads=spider.CALLBACK_THREADS, processes=spider.CALLBACK_PROCESSES
+        )
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy.from_spider(spider)
+        self.stats = stats if stats is not None else self.downloader.stats
 
     async def schedule(
             self,
             yield_res: Optional[Union[BaseRequest, StableResponse, StableItem]]
     ) -> AsyncGenerator:
         """
-        Scheduling entry point:
-          - If the input is a request (an instance of BaseRequest), perform the full scheduling process.
+        Scheduling entry point, for running a spider without the engine:
+          - If the input is a request (an instance of BaseRequest), process it and every request it leads to.
           - Otherwise, directly yield return it (e.g., an Item or final result).
+
+        Requests are taken from a local frontier (higher priority first) by a single work loop, rather than
+        followed recursively, so that a deep chain of pages does not build a chain of nested generators:
+        items reach the caller in one hop, and a response can be collected once its callback is done.
         """
-        if isinstance(yield_res, BaseRequest):
-            async for result in self._process_request(yield_res):
-                yield result
-        else:
+        if not isinstance(yield_res, (BaseRequest, DeferredRequest)):
             yield yield_res
+            return
+
+        frontier = PriorityFrontier()
+        deferred = []  # Heap of (ready time, order, request) of the retries waiting for their delay
+        counter = itertools.count()
 
-    async def _process_request(
+        def push(res: Union[BaseRequest, DeferredRequest]):
+            if isinstance(res, DeferredRequest):
+                heapq.heappush(deferred, (time.monotonic() + res.delay, next(counter), res.request))
+            else:
+                frontier.push(res)
+
+        push(yield_res)
+        while frontier or deferred:
+            # Wait for the next retry only when there is nothing else to do
+            if not frontier:
+                ready_at, _, request = heapq.heappop(deferred)
+                await asyncio.sleep(max(0.0, ready_at - time.monotonic()))
+                frontier.push(request)
+            while deferred and deferred[0][0] <= time.monotonic():
+                frontier.push(heapq.heappop(deferred)[-1])
+
+            async for result in self.process_request(frontier.pop()):
+                if isinstance(result, (BaseRequest, DeferredRequest)):
+                    push(result)
+                else:
+                    yield result
+
+    async def process_request(
             self, request: BaseRequest
     ) -> AsyncGenerator:
+        """
+        Run a single request through the middlewares, the download and its callback.
+
+        New requests produced along the way are yielded as they are, without being followed,
+        so that the caller (e.g. the engine's request queue) decides when to process them.
+        A failed download worth a retry yields a DeferredRequest, which the caller processes again after its delay.
+        """
         spider = self.spider
-        spider.logger.info(f"{spider.SPIDER_NAME} Scheduler processing request: {request.url}")
+        spider.logger.debug("%s Scheduler processing request: %s", spider.SPIDER_NAME, request.url)
 
         # 1. Pre-request middleware processing
-        processed_req = await self._run_request_middlewares(request)
+        with self.stats.timer('request_middleware_latency'):
+            processed_req = await self._run_request_middlewares(request)
         if processed_req is None:
-            spider.logger.info(f"{spider.SPIDER_NAME} Request middleware intercepted request: {request.url}")
+            self.stats.inc('requests_filtered')
+            spider.logger.debug("%s Request middleware intercepted request: %s", spider.SPIDER_NAME, request.url)
             return
 
         # 2. Initiate request
-        response = await processed_req.fetch()
-        spider.logger.info(f"{spider.SPIDER_NAME} Request completed: {request.url}")
-
-        # 3. Response middleware processing
-        processed_response = await self._run_response_middlewares(processed_req, response)
-        if processed_response is None:
-            spider.logger.info(f"{spider.SPIDER_NAME} Response middleware intercepted response: {request.url}")
+        try:
+            response = await self.downloader.fetch(processed_req)
+        except Exception as e:
+            delay = self._get_retry_delay(processed_req, exception=e)
+            if delay is None:
+                raise
+            yield DeferredRequest(processed_req, delay)
             return
-        elif isinstance(processed_response, BaseRequest):
-            spider.logger.info(f"{spider.SPIDER_NAME} Response middleware returned a new request: {request.url}")
-            async for res in self.schedule(processed_response):
-                yield res
+
+        delay = self._get_retry_delay(processed_req, response=response)
+        if delay is not None:
+            await response.aclose()
+            yield DeferredRequest(processed_req, delay)
             return
+        spider.logger.debug("%s Request completed: %s", spider.SPIDER_NAME, request.url)
+
+        try:
+            # 3. Response middleware processing
+            with self.stats.timer('response_middleware_latency'):
+                processed_response = await self._run_response_middlewares(processed_req, response)
+            if processed_response is None:
+                self.stats.inc('responses_filtered')
+                spider.logger.debug(
+                    "%s Response middleware intercepted response: %s", spider.SPIDER_NAME, request.url)
+                return
+            elif isinstance(processed_response, BaseRequest):
+                spider.logger.debug(
+                    "%s Response middleware returned a new request: %s", spider.SPIDER_NAME, request.url)
+                yield processed_response
+                return
 
-        # 4. Invoke callback processing
-        async for res in self._process_callback(processed_req, processed_response):
-            yield res
+            # 4. Invoke callback processing, timing the callback's own work and not the caller's between two results
+            results = self._process_callback(processed_req, processed_response)
+            elapsed = 0.0
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        res = await results.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        elapsed += time.perf_counter() - start
+                    yield res
+            finally:
+                await results.aclose()
+                self.stats.observe('callback_latency', elapsed)
+        finally:
+            # Responses streamed to the callback (iter_chunks) are still open, and their body is counted now
+            if getattr(processed_req, 'iter_chunks', False):
+                await response.aclose()
+                self.stats.inc('bytes_downloaded', response.num_bytes_downloaded)
+
+    def _get_retry_delay(
+            self,
+            request: BaseRequest,
+            response: Optional[StableResponse] = None,
+            exception: Optional[Exception] = None
+    ) -> Optional[float]:
+        """Delay before retrying the failed download, None if it is not retried"""
+        spider = self.spider
+        policy = self.retry_policy
+        retry_after = None
+        if exception is not None:
+            if not policy.is_retryable_exception(exception):
+                return None
+            reason = repr(exception)
+        else:
+            # Selenium pages have no status code
+            status_code = getattr(response, 'status_code', None)
+            if not policy.is_retryable_status(status_code):
+                return None
+            reason = f"status {status_code}"
+            retry_after = policy.parse_retry_after(response.headers.get('retry-after'))
+
+        delay = policy.get_delay(
+            request.retry_times, domain=self.downloader.politeness.get_domain(request), retry_after=retry_after
+        )
+        if delay is None:
+            spider.logger.warning(
+                f"{spider.SPIDER_NAME} Giving up {request.url} after {request.retry_times} retries: {reason}"
+            )
+            return None
+
+        request.retry_times += 1
+        spider.logger.info(
+            "%s Retrying %s in %.2fs (retry %d/%d): %s",
+            spider.SPIDER_NAME, request.url, delay, request.retry_times, policy.max_retries, reason
+        )
+        return delay
 
     async def _run_request_middlewares(
             self, request: BaseRequest
@@ -65,8 +204,8 @@ class Schedule:
         for middleware in self.request_middleware_instances:
             request = await middleware.process_request(request)
             if request is None:
-                self.spider.logger.info(
-                    f"{self.spider.SPIDER_NAME} Request middleware {middleware} intercepted the request")
+                self.spider.logger.debug(
+                    "%s Request middleware %s intercepted the request", self.spider.SPIDER_NAME, middleware)
                 return None
         return request
 
@@ -78,12 +217,12 @@ class Schedule:
         for middleware in self.request_middleware_instances:
             response = await middleware.process_response(request=request, response=response)
             if response is None:
-                self.spider.logger.info(
-                    f"{self.spider.SPIDER_NAME} Response middleware {middleware} intercepted the response")
+                self.spider.logger.debug(
+                    "%s Response middleware %s intercepted the response", self.spider.SPIDER_NAME, middleware)
                 return None
             elif isinstance(response, BaseRequest):
-                self.spider.logger.info(
-                    f"{self.spider.SPIDER_NAME} Response middleware {middleware} returned a new request")
+                self.spider.logger.debug(
+                    "%s Response middleware %s returned a new request", self.spider.SPIDER_NAME, middleware)
                 return response
         return response
 
@@ -93,82 +232,23 @@ class Schedule:
             response: StableResponse,
     ) -> AsyncGenerator:
         callback = request.callback
-        self.spider.logger.info(f"{self.spider.SPIDER_NAME} Invoking callback function: {callback}")
+        # Callbacks may be given by name, e.g. requests restored from disk or sent back by a worker process
+        if isinstance(callback, str):
+            callback = getattr(self.spider, callback)
+        self.spider.logger.debug("%s Invoking callback function: %s", self.spider.SPIDER_NAME, callback)
         meta = request.meta
 
         if callback is None:
             yield response
+        # CPU-bound callbacks run in a thread or process pool, off the event loop
+        elif self.callback_executor.get_mode(callback):
+            for callback_res in await self.callback_executor.run(callback, response, meta):
+                yield callback_res
         # If the callback is an async generator function, call it asynchronously
         elif inspect.isasyncgenfunction(callback):
             async for callback_res in callback(response=response, meta=meta):
-                async for res in self.schedule(callback_res):
-                    yield res
+                yield callback_res
         elif asyncio.iscoroutinefunction(callback):
-            callback_res = await callback(response=response, meta=meta)
-            async for res in self.schedule(callback_res):
-                yield res
+            yield await callback(response=response, meta=meta)
         else:
-            callback_res = callback(response=response, meta=meta)
-            async for res in self.schedule(callback_res):
-                yield res
-
-    # async def schedule(self, yield_res: StableRequest = None):
-    #
-    #     # 如果是请求那么发送请求,寻找callback
-    #     if isinstance(yield_res, BaseRequest):
-    #         self.spider.logger.info(f"{self.spider.SPIDER_NAME} 调度器接受请求:{yield_res.url}")
-    #
-    #         request = yield_res
-    #         # 发送请求前 执行请求中间件
-    #         for request_middleware_instance in self.request_middleware_instances:
-    #             # 调用中间件中处理请求方法
-    #             request = await request_middleware_instance.process_request(request)
-    #             # 如果返回为None则break,本次请求结束
-    #             if request is None:
-    #                 self.spider.logger.info(
-    #                     f"{self.spider.SPIDER_NAME} 请求中间件 {request_middleware_instance} 未通过:{yield_res.url}"
-    #                 )
-    #                 # async for schedule_res in self.schedule(yield_res=None):
-    #                 #     yield schedule_res
-    #                 break
-    #         else:
-    #             # 中间件通过,发出请求
-    #             response = await request.fetch()
-    #             self.spider.logger.info(f"{self.spider.SPIDER_NAME} 请求中间件通过:{yield_res.url}")
-    #
-    #             # 发送请求后 执行请求中间件
-    #             for request_middleware_instance in self.request_middleware_instances:
-    #                 response = await request_middleware_instance.process_response(request=request, response=response)
-    #
-    #                 # 如果返回为None则break,本次请求结束
-    #                 if response is None:
-    #                     self.spider.logger.info(
-    #                         f"{self.spider.SPIDER_NAME} 响应中间未件{request_middleware_instance} 未通过:{yield_res.url} 抛弃")
-    #                     break
-    #
-    #                 # 如果是请求则返回到调度器重新执行
-    #                 elif isinstance(response, StableRequest):
-    #                     self.spider.logger.info(
-    #                         f"{self.spider.SPIDER_NAME} 响应中间件{request_middleware_instance} 未通过:{yield_res.url} 重新请求")
-    #                     async for schedule_res in self.schedule(yield_res=yield_res):
-    #                         yield schedule_res
-    #             else:
-    #                 self.spider.logger.info(f"{self.spider.SPIDER_NAME} 响应中间件通过:{yield_res.url}")
-    #
-    #                 # 获取回调函数
-    #                 callback = request.callback
-    #                 self.spider.logger.info(f"{self.spider.SPIDER_NAME} 回调函数为:{callback}")
-    #
-    #                 # 获取meta
-    #                 meta = request.meta
-    #                 # 如果是生成器则 再次异步调用回调函数 调用即可无需返回
-    #                 if inspect.isasyncgenfunction(callback):
-    #                     async for callback_res in callback(response=response, meta=meta):
-    #                         async for schedule_res in self.schedule(yield_res=callback_res):
-    #                             yield schedule_res
-    #                 elif asyncio.iscoroutinefunction(callback):
-    #                     callback_res = await callback(response=response, meta=meta)
-    #                     async for schedule_res in self.schedule(yield_res=callback_res):
-    #                         yield schedule_res
-    #     else:
-    #         yield yield_res
+            yield callback(response=response, meta=meta)
@@ -0,0 +1,150 @@
+from http.cookiejar import Cookie, CookieJar, DefaultCookiePolicy
+from typing import Dict, Hashable, List, Optional
+
+import httpx
+
+from core.request import BaseRequest
+from core.response import StableResponse
+
+
+class NoCookiesPolicy(DefaultCookiePolicy):
+    """Cookie policy of the pooled HTTP client: cookies are kept by the SessionStore, not by the client"""
+
+    def set_ok(self, cookie, request) -> bool:
+        return False
+
+    def return_ok(self, cookie, request) -> bool:
+        return False
+
+
+class SessionStore:
+    def __init__(self):
+        """
+        Cookie jars of the crawl, one per session, shared by all the requests of the session.
+
+        A request belongs to the session named by its meta['session'], the default session (None) otherwise.
+        Each jar scopes its cookies by domain and path like a browser does, and can be filled from, or copied
+        to, a Selenium browser: log in once with the browser, then crawl with plain HTTP requests.
+        """
+        self.jars: Dict[Optional[Hashable], httpx.Cookies] = {}
+
+    def get_jar(self, session: Optional[Hashable] = None) -> httpx.Cookies:
+        jar = self.jars.get(session)
+        if jar is None:
+            jar = self.jars[session] = httpx.Cookies()
+        return jar
+
+    @staticmethod
+    def get_session(request: BaseRequest) -> Optional[Hashable]:
+        return request.meta.get('session')
+
+    def get_cookie_header(self, request: BaseRequest) -> Optional[str]:
+        """Cookie header of the request: the cookies of its session for its URL, then its own cookies"""
+        jar = self.jars.get(self.get_session(request))
+        cookies: Dict[str, str] = {}
+        if jar:
+            probe = httpx.Request(request.method, request.url)
+            jar.set_cookie_header(probe)
+            for pair in probe.headers.get('cookie', '').split('; '):
+                name, sep, value = pair.partition('=')
+                if sep:
+                    cookies[name] = value
+        if request.cookies:
+            cookies.update(httpx.Cookies(request.cookies).items())
+        return '; '.join(f"{name}={value}" for name, value in cookies.items()) if cookies else None
+
+    def extract_cookies(self, request: BaseRequest, response: StableResponse):
+        """Store the cookies set by a response in the session of its request"""
+        # Selenium pages have no headers, the browser keeps their cookies
+        if getattr(response, 'status_code', None) is None or 'set-cookie' not in response.headers:
+            return
+        jar = self.get_jar(self.get_session(request))
+        jar.extract_cookies(httpx.Response(
+            response.status_code, headers=response.headers, request=httpx.Request(request.method, response.url)
+        ))
+
+    def import_cookies(self, cookies: List[Dict], session: Optional[Hashable] = None):
+        """
+        Add cookies in the Selenium format, as returned by SeleniumDriver.get_cookies(), to a session.
+
+        Args:
+            cookies: dicts with 'name', 'value' and optionally 'domain', 'path', 'secure', 'httpOnly', 'expiry'.
+            session: the session the cookies are added to.
+        """
+        jar = self.get_jar(session).jar
+        for cookie in cookies:
+            domain = cookie.get('domain') or ''
+            expiry = cookie.get('expiry')
+            jar.set_cookie(Cookie(
+                version=0,
+                name=cookie['name'],
+                value=cookie['value'],
+                port=None,
+                port_specified=False,
+                domain=domain,
+                # Selenium prefixes the domain with a dot for cookies sent to subdomains as well
+                domain_specified=domain.startswith('.'),
+                domain_initial_dot=domain.startswith('.'),
+                path=cookie.get('path') or '/',
+                path_specified=True,
+                secure=bool(cookie.get('secure')),
+                expires=int(expiry) if expiry is not None else None,
+                discard=expiry is None,
+                comment=None,
+                comment_url=None,
+                rest={'HttpOnly': None} if cookie.get('httpOnly') else {},
+            ))
+
+    def export_cookies(self, session: Optional[Hashable] = None, domain: Optional[str] = None) -> List[Dict]:
+        """
+        Cookies of a session in the Selenium format, for SeleniumDriver.add_cookies().
+
+        Args:
+            session: the session whose cookies are exported.
+            domain: only export the cookies sent to this host, None for all of them.
+        """
+        jar = self.jars.get(session)
+        if jar is None:
+            return []
+        cookies = []
+        for cookie in jar.jar:
+            cookie_domain = cookie.domain.lstrip('.')
+            if domain is not None and domain != cookie_domain and not domain.endswith('.' + cookie_domain):
+                continue
+            exported = {
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'secure': cookie.secure,
+                'httpOnly': cookie.has_nonstandard_attr('HttpOnly'),
+            }
+            if cookie.expires is not None:
+                exported['expiry'] = cookie.expires
+            cookies.append(exported)
+        return cookies
+
+    def load_from_driver(self, driver, session: Optional[Hashable] = None):
+        """
+        Copy the cookies of the page the Selenium driver is on into a session.
+
+        WebDriver calls are blocking: run this in a thread, e.g. `await driver_pool.run(store.load_from_driver,
+        driver)` or through loop.run_in_executor().
+        """
+        self.import_cookies(driver.get_cookies(), session=session)
+
+    def apply_to_driver(self, driver, session: Optional[Hashable] = None, domain: Optional[str] = None):
+        """
+        Copy the cookies of a session into the Selenium driver, which must be on a page of their domain.
+
+        Blocking, see load_from_driver().
+        """
+        driver.add_cookies(self.export_cookies(session=session, domain=domain))
+
+    def clear(self, session: Optional[Hashable] = None):
+        self.jars.pop(session, None)
+
+
+def create_client_cookie_jar() -> CookieJar:
+    """Cookie jar of the pooled HTTP client, which leaves cookies to the SessionStore"""
+    return CookieJar(policy=NoCookiesPolicy())
@@ -1,20 +1,25 @@
 from __future__ import annotations
+import copy
 import logging
 import random
 import time
 from typing import AsyncGenerator, List, Literal, Optional
 
+import httpx
 from selenium.webdriver import DesiredCapabilities, ActionChains
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 
+from core.dupefilter import BaseSeenSet, BloomSeenSet, MemorySeenSet
+from core.hybrid import DEFAULT_CHALLENGE_MARKERS, BrowserDetector, HybridRouter
 from core.response import StableResponse
+from core.session import SessionStore, create_client_cookie_jar
 from log import create_logger
 from core.request import StableRequest
 from middlewares.item_middleware import ItemMiddleware
-from middlewares.request_middleware import RequestMiddleware
-from utils.selenium_driver import SeleniumDriver
+from middlewares.request_middleware import RequestMiddleware, UserAgentMiddleware
+from utils.selenium_driver import RenderProfile, SeleniumDriver, SeleniumDriverPool
 
 
 class Spider:
@@ -23,11 +28,79 @@ class Spider:
     REQUEST_MIDDLEWARES: List['RequestMiddleware'] = []  # Request middlewares
     ITEM_MIDDLEWARES: List['ItemMiddleware'] = []  # Item middlewares
 
-    DEFAULT_REQUEST_MIDDLEWARES: List['RequestMiddleware'] = []  # Default request middlewares
+    # Default request middlewares
+    DEFAULT_REQUEST_MIDDLEWARES: List['RequestMiddleware'] = [RequestMiddleware, UserAgentMiddleware]
     DEFAULT_ITEM_MIDDLEWARES: List['ItemMiddleware'] = []  # Default item middlewares
 
     START_URL_LIST = []  # Starting request URLs
 
+    LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"  # Per-request messages are DEBUG
+    LOG_FORMAT: Literal["text", "json"] = "text"  # 'json' writes JSON lines
+    LOG_SAMPLE_RATE = 1.0  # Share of the DEBUG and INFO messages kept
+
+    CONCURRENT_REQUESTS = 8  # Maximum number of requests in flight for this spider
+    CONCURRENT_REQUESTS_PER_DOMAIN = 1  # Maximum number of requests in flight per host
+    DOWNLOAD_DELAY = 3  # Minimum interval in seconds between two requests to the same host
+    DOWNLOAD_DELAY_JITTER = 5  # Additional random range in seconds added to DOWNLOAD_DELAY
+    DOWNLOAD_MAXSIZE: Optional[int] = None  # Largest response body in bytes of a StableRequest, None for no limit
+
+    AUTOTHROTTLE_ENABLED = False  # Adapt per-host delay and concurrency to the observed latency and errors
+    AUTOTHROTTLE_TARGET_LATENCY = 1.0  # Average latency in seconds above which a host is slowed down
+    AUTOTHROTTLE_MIN_DELAY = 0  # Smallest per-host delay in seconds
+    AUTOTHROTTLE_MAX_DELAY = 60  # Largest per-host delay in seconds
+    AUTOTHROTTLE_DELAY_STEP = 0.25  # Additive delay change in seconds
+    AUTOTHROTTLE_MAX_CONCURRENCY = 8  # Largest number of requests in flight per host
+    AUTOTHROTTLE_BACKOFF_FACTOR = 0.5  # Concurrency multiplier on 429/5xx responses, errors and timeouts
+    AUTOTHROTTLE_JITTER = 0.2  # Random range added to the delay, as a fraction of the delay
+
+    RETRY_TIMES = 3  # Maximum number of retries of a failed download
+    RETRY_HTTP_CODES = frozenset({408, 429, 500, 502, 503, 504})  # Response status codes retried
+    RETRY_BACKOFF_BASE = 1  # Delay before the first retry in seconds, doubled at each retry
+    RETRY_BACKOFF_MAX = 60  # Maximum backoff delay in seconds
+    RETRY_JITTER = 0.5  # Fraction of the backoff delay that is randomized
+    RETRY_MAX_RETRY_AFTER = 300  # Longest Retry-After honoured, in seconds
+    RETRY_BUDGET: Optional[float] = 10  # Retries available at once per domain, None for no budget
+    RETRY_BUDGET_REFILL_RATE = 0.5  # Retries regained per second per domain
+
+    HTTPCACHE_ENABLED = False  # Cache StableRequest responses on disk and revalidate them with ETag/Last-Modified
+    HTTPCACHE_PATH: Optional[str] = None  # SQLite database of the cache, ./httpcache/<spider_name>.sqlite3 if None
+    HTTPCACHE_TTL: Optional[float] = 0  # Seconds a response is served without revalidation, None for forever
+    HTTPCACHE_MAX_SIZE: Optional[int] = None  # Size of the cached bodies in bytes beyond which LRU ones are evicted
+    HTTPCACHE_MODE: Literal['normal', 'replay'] = 'normal'  # 'replay' serves only from the cache, never downloads
+    HTTPCACHE_HTTP_CODES = frozenset({200, 203, 301, 308, 404, 410})  # Response status codes cached
+
+    DUPEFILTER: Literal['memory', 'bloom'] = 'memory'  # Seen set used to filter duplicate requests
+    DUPEFILTER_MAX_MEMORY: Optional[int] = 256 * 1024 * 1024  # Memory bound of the 'memory' seen set, in bytes
+    DUPEFILTER_CAPACITY = 10_000_000  # Expected number of requests for the 'bloom' seen set
+    DUPEFILTER_ERROR_RATE = 0.001  # False positive rate of Bloom filters
+
+    FRONTIER: Literal['priority', 'fifo', 'lifo', 'disk'] = 'priority'  # Order in which requests are crawled
+    FRONTIER_MEMORY_SIZE = 10000  # Requests kept in memory by the disk frontier
+    FRONTIER_PATH: Optional[str] = None  # Directory of the disk frontier's private spill file, ./frontier if None
+
+    CALLBACK_THREADS: Optional[int] = None  # Thread pool size for @cpu_bound('thread') callbacks
+    CALLBACK_PROCESSES: Optional[int] = None  # Process pool size for @cpu_bound('process') callbacks, CPU count if None
+
+    STATS_LOG_INTERVAL: Optional[float] = 60  # Seconds between two crawl summaries in the log, None to disable
+    STATS_HTTP_HOST = '127.0.0.1'  # Interface of the metrics endpoint
+    STATS_HTTP_PORT: Optional[int] = None  # Port serving /metrics (Prometheus) and /stats (JSON), None to disable
+
+    ITEM_QUEUE_SIZE = 1000  # Items waiting for the item middlewares before the workers block
+    ITEM_CONSUMERS = 4  # Tasks running items through the item middlewares
+
+    COOKIES_ENABLED = True  # Keep the cookies set by responses, per meta['session'], see Spider.sessions
+
+    USER_AGENT: Optional[str] = None  # User-Agent of every StableRequest, None to rotate real-world agents
+    USER_AGENT_BROWSERS: Optional[List[str]] = None  # Browsers rotated, e.g. ['Chrome', 'Firefox'], None for all
+    USER_AGENT_OS: Optional[List[str]] = None  # Operating systems rotated, e.g. ['Windows'], None for all
+    USER_AGENT_TYPES: Optional[List[str]] = ['desktop']  # Device types rotated: 'desktop', 'mobile', 'tablet'
+    USER_AGENT_STICKY: Optional[Literal['domain', 'session']] = None  # Keep one agent per host or meta['session']
+
+    HTTP2 = False  # Negotiate HTTP/2 on the shared client (requires the h2 package)
+    HTTP_MAX_CONNECTIONS = 100  # Maximum number of connections in the client pool
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 20  # Maximum number of idle keep-alive connections
+    HTTP_KEEPALIVE_EXPIRY = 5.0  # Seconds an idle keep-alive connection is kept open
+
     def __init__(self, need_default_request_middleware=True, need_default_item_middleware=True):
         """
             You need to implement start_spider() yourself, and it must be a generator.
@@ -47,15 +120,53 @@ class Spider:
             self.request_middlewares.extend(self.DEFAULT_REQUEST_MIDDLEWARES.copy())
         if need_default_item_middleware:
             self.item_middlewares.extend(self.DEFAULT_ITEM_MIDDLEWARES.copy())
-        self.logger: logging.Logger = create_logger(self.SPIDER_NAME)
+        self.logger: logging.Logger = create_logger(
+            self.SPIDER_NAME, log_level=self.LOG_LEVEL, log_format=self.LOG_FORMAT, sample_rate=self.LOG_SAMPLE_RATE
+        )
+        # Shared HTTP client, owned by the spider lifecycle
+        self.http_client: Optional[httpx.AsyncClient] = None
+        # Fingerprints of the requests already seen, shared by the request middlewares
+        self.seen_set: BaseSeenSet = self.create_seen_set()
+        # Cookie jars of the crawl, by meta['session']
+        self.sessions = SessionStore()
+
+    def create_seen_set(self) -> BaseSeenSet:
+        """Build the seen set selected by the DUPEFILTER setting."""
+        if self.DUPEFILTER == 'memory':
+            return MemorySeenSet(max_memory=self.DUPEFILTER_MAX_MEMORY, error_rate=self.DUPEFILTER_ERROR_RATE)
+        elif self.DUPEFILTER == 'bloom':
+            return BloomSeenSet(capacity=self.DUPEFILTER_CAPACITY, error_rate=self.DUPEFILTER_ERROR_RATE)
+        raise ValueError(f"Unknown dupefilter: {self.DUPEFILTER}")
+
+    def create_http_client(self) -> httpx.AsyncClient:
+        """Build the pooled HTTP client shared by all requests of this spider."""
+        limits = httpx.Limits(
+            max_connections=self.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=self.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=self.HTTP_KEEPALIVE_EXPIRY,
+        )
+        # Cookies are kept per session by self.sessions, not by the client
+        return httpx.AsyncClient(limits=limits, http2=self.HTTP2, cookies=create_client_cookie_jar())
 
     # Spider start
-    async def spider_start(self):
+    async def spider_start(self, resume: bool = False):
+        """
+        Open the spider's resources and yield its start requests.
+
+        Args:
+            resume: the crawl is resumed from a job directory, the start requests are not yielded again.
+        """
+        if self.http_client is None:
+            self.http_client = self.create_http_client()
+
         self.logger.info(f"request middlewares: {self.request_middlewares}")
         self.logger.info(f"item middlewares: {self.item_middlewares}")
         self.logger.info(f"start url list: {self.start_url_list}")
 
         self.logger.info(f"spider_name: {self.spider_name} start")
+        if resume:
+            self.logger.info(f"spider_name: {self.spider_name} resumed, skipping start requests")
+            return
         async for request in self.start_request():
             yield request
 
@@ -65,12 +176,22 @@ class Spider:
             yield StableRequest(url=start_url, method='GET', callback=self.parse, need_request_filter=False)
 
     async def spider_end(self):
-        pass
+        self.logger.info(f"{self.spider_name} dupefilter stats: {self.seen_set.get_stats()}")
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
 
 
 class SeleniumSpider(Spider):
     SPIDER_NAME = "Spider"  # Spider name
 
+    HYBRID_REQUIRED_XPATH: Optional[str] = None  # XPath a page fetched over HTTP must match, else it is rendered
+    HYBRID_MIN_BODY_SIZE = 0  # Smallest body in bytes of a page fetched over HTTP, else it is rendered
+    HYBRID_CHALLENGE_MARKERS = DEFAULT_CHALLENGE_MARKERS  # Page contents that send a page to the browser
+    HYBRID_STATUSES = frozenset()  # Status codes that send a page to the browser, e.g. {403}
+    HYBRID_URL_PATTERNS: Optional[List[str]] = None  # Regexes grouping URLs whose route is learnt together
+    HYBRID_PROBE_INTERVAL = 50  # Browser fetches of a URL pattern between two plain HTTP attempts
+
     def __init__(
             self,
             options: Optional[webdriver.ChromeOptions] = None,
@@ -83,8 +204,18 @@ class SeleniumSpider(Spider):
             debug: bool = False,
             selenium_driver=SeleniumDriver,
             need_default_request_middleware=True,
-            need_default_item_middleware=True
+            need_default_item_middleware=True,
+            pool_size: int = 1,
+            max_pages_per_driver: Optional[int] = None,
+            render_profile: Optional[RenderProfile] = None
     ):
+        """
+            self.driver is a single driver for direct use in callbacks, started on first access.
+            self.driver_pool holds up to pool_size more drivers, created on demand, for concurrent
+            StableSeleniumRequest(driver=self.driver_pool); a pooled driver is replaced after
+            max_pages_per_driver pages or after a WebDriver error.
+            render_profile is the drivers' default render profile, e.g. LIGHT_RENDER.
+        """
         super().__init__(
             need_default_request_middleware=need_default_request_middleware,
             need_default_item_middleware=need_default_item_middleware
@@ -97,8 +228,34 @@ class SeleniumSpider(Spider):
         self.need_default_options = need_default_options
         self.grid_hub_url = grid_hub_url
         self.debug = debug
-        self.driver = selenium_driver(
-            options=self.options,
+        self.render_profile = render_profile
+        self.selenium_driver = selenium_driver
+        # Drivers add their default arguments to the options, every pooled driver gets a pristine copy
+        pool_options = copy.deepcopy(self.options)
+        self.driver_pool = SeleniumDriverPool(
+            driver_factory=lambda: self.create_driver(options=copy.deepcopy(pool_options)),
+            size=pool_size,
+            max_pages=max_pages_per_driver,
+        )
+        # self.driver is started on first use, a spider crawling through the pool never launches it
+        self._driver: Optional[SeleniumDriver] = None
+        # Routes StableHybridRequests to plain HTTP or to the driver pool
+        self.hybrid_router = self.create_hybrid_router()
+
+    @property
+    def driver(self) -> SeleniumDriver:
+        if self._driver is None:
+            self._driver = self.create_driver(options=self.options)
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver: SeleniumDriver):
+        self._driver = driver
+
+    def create_driver(self, options: Optional[webdriver.ChromeOptions] = None) -> SeleniumDriver:
+        """Start a driver with the spider's browser settings."""
+        return self.selenium_driver(
+            options=options,
             service=self.service,
             keep_alive=self.keep_alive,
             browser=self.browser,
@@ -106,10 +263,33 @@ class SeleniumSpider(Spider):
             need_default_options=self.need_default_options,
             timeout=self.timeout,
             debug=self.debug,
+            render_profile=self.render_profile,
+        )
+
+    def create_hybrid_router(self) -> HybridRouter:
+        detector = BrowserDetector(
+            required_xpath=self.HYBRID_REQUIRED_XPATH,
+            min_body_size=self.HYBRID_MIN_BODY_SIZE,
+            challenge_markers=self.HYBRID_CHALLENGE_MARKERS,
+            statuses=self.HYBRID_STATUSES,
+        )
+        return HybridRouter(
+            driver=self.driver_pool,
+            detector=detector,
+            render_profile=self.render_profile,
+            url_patterns=self.HYBRID_URL_PATTERNS,
+            probe_interval=self.HYBRID_PROBE_INTERVAL,
         )
 
     def __del__(self):
-        self.driver.quit()
+        if getattr(self, '_driver', None) is not None:
+            self._driver.quit()
 
     async def spider_end(self):
-        self.driver.quit()
+        await super().spider_end()
+        if self.hybrid_router.routes:
+            self.logger.info(f"{self.spider_name} hybrid routes: {self.hybrid_router.get_state()}")
+        await self.driver_pool.close()
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
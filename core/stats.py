@@ -0,0 +1,229 @@
+import asyncio
+import bisect
+import json
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+
+class Histogram:
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Upper bounds, in seconds
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        """Distribution of durations, counted in fixed buckets."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket counts the values above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile: the upper bound of the bucket it falls in, at most the largest value seen"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class StatsCollector:
+    def __init__(
+            self,
+            spider,
+            log_interval: Optional[float] = 60,
+            http_host: str = '127.0.0.1',
+            http_port: Optional[int] = None
+    ):
+        """
+        Crawl metrics: counters and duration histograms, recorded by the engine, downloader, scheduler and
+        item pipeline.
+
+        Names may carry a label after a slash, e.g. 'response_status/200', exported to Prometheus as
+        stable_spider_response_status_total{label="200"}.
+
+        Args:
+            spider: the spider the metrics belong to.
+            log_interval: seconds between two summaries in the log, None to disable them.
+            http_host: interface of the metrics endpoint.
+            http_port: port of the metrics endpoint, serving /metrics (Prometheus text) and /stats (JSON),
+                None to disable it.
+        """
+        self.spider = spider
+        self.log_interval = log_interval
+        self.http_host = http_host
+        self.http_port = http_port
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.start_time = time.time()
+        self._log_task: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @classmethod
+    def from_spider(cls, spider) -> 'StatsCollector':
+        return cls(
+            spider=spider,
+            log_interval=spider.STATS_LOG_INTERVAL,
+            http_host=spider.STATS_HTTP_HOST,
+            http_port=spider.STATS_HTTP_PORT,
+        )
+
+    def inc(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_value(self, name: str, default: float = 0) -> float:
+        return self.counters.get(name, default)
+
+    def observe(self, name: str, value: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Observe the time spent in the block, which may await"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def get_stats(self) -> Dict:
+        elapsed = time.time() - self.start_time
+        return {
+            'elapsed': elapsed,
+            'counters': dict(self.counters),
+            'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+        }
+
+    def to_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        typed = set()
+
+        def declare(metric: str, metric_type: str):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {metric_type}")
+
+        for name, value in sorted(self.counters.items()):
+            metric, labels = self._split_name(name)
+            metric = f"{metric}_total"
+            declare(metric, 'counter')
+            lines.append(f"{metric}{self._format_labels(labels)} {value}")
+
+        for name, histogram in sorted(self.histograms.items()):
+            metric, labels = self._split_name(name)
+            metric = f"{metric}_seconds"
+            declare(metric, 'histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f"{metric}_bucket{self._format_labels(labels, le=le)} {cumulative}")
+            lines.append(f"{metric}_sum{self._format_labels(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{self._format_labels(labels)} {histogram.count}")
+
+        metric = 'stable_spider_elapsed_seconds'
+        declare(metric, 'gauge')
+        lines.append(f"{metric} {time.time() - self.start_time}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _split_name(name: str) -> Tuple[str, Optional[str]]:
+        metric, _, label = name.partition('/')
+        return 'stable_spider_' + re.sub(r'[^a-zA-Z0-9_]', '_', metric), label or None
+
+    @staticmethod
+    def _format_labels(label: Optional[str], le: Optional[str] = None) -> str:
+        labels = []
+        if label is not None:
+            escaped = label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            labels.append(f'label="{escaped}"')
+        if le is not None:
+            labels.append(f'le="{le}"')
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+    async def start(self):
+        """Start the periodic summary and the metrics endpoint"""
+        self.start_time = time.time()
+        if self.log_interval:
+            self._log_task = asyncio.create_task(self._log_loop())
+        if self.http_port is not None:
+            self._server = await asyncio.start_server(self._serve, self.http_host, self.http_port)
+            self.spider.logger.info(
+                f"{self.spider.spider_name} serving metrics on http://{self.http_host}:{self.http_port}/metrics"
+            )
+
+    async def _log_loop(self):
+        pages = items = 0
+        while True:
+            await asyncio.sleep(self.log_interval)
+            new_pages = self.get_value('requests_processed')
+            new_items = self.get_value('items_scraped')
+            rate = 60 / self.log_interval
+            self.spider.logger.info(
+                "%s Crawled %d pages (at %.0f pages/min), scraped %d items (at %.0f items/min)",
+                self.spider.spider_name, new_pages, (new_pages - pages) * rate, new_items, (new_items - items) * rate
+            )
+            pages, items = new_pages, new_items
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # Skip the request headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) > 1 else '/'
+
+            if path == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4', self.to_prometheus()
+            elif path in ('/stats', '/stats.json'):
+                status, content_type, body = '200 OK', 'application/json', json.dumps(self.get_stats())
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', 'Not Found\n'
+
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        """Stop the summary and the endpoint, then log the final stats"""
+        if self._log_task is not None:
+            self._log_task.cancel()
+            await asyncio.gather(self._log_task, return_exceptions=True)
+            self._log_task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self.spider.logger.info(f"{self.spider.spider_name} crawl stats: {json.dumps(self.get_stats(), indent=2)}")
@@ -0,0 +1,167 @@
+import math
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from core.politeness import DomainSlot, Politeness
+from core.request import BaseRequest
+
+
+class ThrottleState:
+    def __init__(self):
+        """Observations of a single host."""
+        self.latency: Optional[float] = None  # Moving average of the response latency, in seconds
+        self.error_rate = 0.0  # Moving average of the share of throttled, failed or timed out requests
+        self.responses = 0  # Responses since the last adjustment
+        self.last_decrease = 0.0  # time.monotonic() of the last slowdown
+
+
+class AutoThrottle:
+    def __init__(
+            self,
+            politeness: Politeness,
+            target_latency: float = 1.0,
+            min_delay: float = 0,
+            max_delay: float = 60,
+            delay_step: float = 0.25,
+            min_concurrency: int = 1,
+            max_concurrency: int = 8,
+            backoff_factor: float = 0.5,
+            jitter: float = 0.2,
+            smoothing: float = 0.3
+    ):
+        """
+        Adjust the delay and concurrency of each host from what its responses look like, in the spirit of AIMD
+        congestion control.
+
+        Every round of healthy responses (as many as the host's concurrency) with an average latency under the
+        target speeds the host up additively: first the delay drops by delay_step down to min_delay, then the
+        concurrency grows by one up to max_concurrency. A 429 or 5xx response, a transport error or a timeout
+        slows it down multiplicatively: the concurrency is multiplied by backoff_factor, and once it is at
+        min_concurrency the delay is doubled up to max_delay; further slowdowns wait until the requests
+        sent before the last one have had time to come back. A latency above the target slows the host down
+        additively instead.
+
+        Requests setting request_interval_time or request_interval_time_random_range keep their own interval.
+
+        Args:
+            politeness: the politeness whose per-host slots are adjusted.
+            target_latency: average latency in seconds above which a host is considered overloaded.
+            min_delay: smallest delay between two requests to a host.
+            max_delay: largest delay between two requests to a host.
+            delay_step: additive delay change, in seconds.
+            min_concurrency: smallest number of requests in flight per host.
+            max_concurrency: largest number of requests in flight per host.
+            backoff_factor: multiplicative decrease of the concurrency.
+            jitter: random range added to the delay, as a fraction of the delay.
+            smoothing: weight of the newest observation in the moving averages.
+        """
+        self.politeness = politeness
+        self.target_latency = target_latency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.smoothing = smoothing
+        self.states: Dict[str, ThrottleState] = {}
+        # New hosts start from the politeness defaults, kept within the throttle's bounds
+        politeness.delay = min(max_delay, max(min_delay, politeness.delay))
+        politeness.jitter = politeness.delay * jitter
+        politeness.concurrency_per_domain = min(
+            max_concurrency, max(min_concurrency, politeness.concurrency_per_domain)
+        )
+
+    @classmethod
+    def from_spider(cls, spider, politeness: Politeness) -> 'AutoThrottle':
+        return cls(
+            politeness=politeness,
+            target_latency=spider.AUTOTHROTTLE_TARGET_LATENCY,
+            min_delay=spider.AUTOTHROTTLE_MIN_DELAY,
+            max_delay=spider.AUTOTHROTTLE_MAX_DELAY,
+            delay_step=spider.AUTOTHROTTLE_DELAY_STEP,
+            max_concurrency=spider.AUTOTHROTTLE_MAX_CONCURRENCY,
+            backoff_factor=spider.AUTOTHROTTLE_BACKOFF_FACTOR,
+            jitter=spider.AUTOTHROTTLE_JITTER,
+        )
+
+    def get_domain_state(self, request: BaseRequest) -> ThrottleState:
+        domain = self.politeness.get_domain(request)
+        state = self.states.get(domain)
+        if state is None:
+            state = self.states[domain] = ThrottleState()
+        return state
+
+    def on_response(self, request: BaseRequest, latency: float, status_code: Optional[int]):
+        """Feed the latency and status of a response"""
+        state = self.get_domain_state(request)
+        state.latency = latency if state.latency is None else self._average(state.latency, latency)
+        congested = status_code is not None and (status_code == 429 or status_code >= 500)
+        state.error_rate = self._average(state.error_rate, 1.0 if congested else 0.0)
+        if congested:
+            self._slow_down(request, state)
+        else:
+            self._speed_up(request, state)
+
+    def on_error(self, request: BaseRequest, exception: BaseException):
+        """Feed a failed download; transport errors and timeouts slow the host down"""
+        if not isinstance(exception, httpx.TransportError):
+            return
+        state = self.get_domain_state(request)
+        state.error_rate = self._average(state.error_rate, 1.0)
+        if isinstance(exception, httpx.TimeoutException):
+            timeout = request.timeout if isinstance(request.timeout, (int, float)) else self.target_latency
+            state.latency = timeout if state.latency is None else self._average(state.latency, timeout)
+        self._slow_down(request, state)
+
+    def _average(self, average: float, value: float) -> float:
+        return (1 - self.smoothing) * average + self.smoothing * value
+
+    def _speed_up(self, request: BaseRequest, state: ThrottleState):
+        slot = self.politeness.get_slot(request)
+        state.responses += 1
+        # Adjust once per round of responses, so that a higher concurrency is not adjusted faster
+        if state.responses < slot.concurrency:
+            return
+        state.responses = 0
+
+        if state.latency > self.target_latency:
+            self._set(slot, delay=slot.delay + self.delay_step, concurrency=slot.concurrency - 1)
+        elif slot.delay > self.min_delay:
+            self._set(slot, delay=slot.delay - self.delay_step, concurrency=slot.concurrency)
+        else:
+            self._set(slot, delay=slot.delay, concurrency=slot.concurrency + 1)
+
+    def _slow_down(self, request: BaseRequest, state: ThrottleState):
+        slot = self.politeness.get_slot(request)
+        state.responses = 0
+        # One slowdown per burst: the requests already in flight report the same congestion
+        now = time.monotonic()
+        if now - state.last_decrease < max(state.latency or 0.0, slot.delay):
+            return
+        state.last_decrease = now
+
+        if slot.concurrency > self.min_concurrency:
+            self._set(slot, delay=slot.delay, concurrency=math.floor(slot.concurrency * self.backoff_factor))
+        else:
+            self._set(slot, delay=max(slot.delay * 2, self.delay_step), concurrency=slot.concurrency)
+
+    def _set(self, slot: DomainSlot, delay: float, concurrency: int):
+        slot.delay = min(self.max_delay, max(self.min_delay, delay))
+        slot.jitter = slot.delay * self.jitter
+        slot.concurrency = min(self.max_concurrency, max(self.min_concurrency, concurrency))
+
+    def get_state(self) -> Dict:
+        """Current per-domain throttle state, for monitoring."""
+        politeness_state = self.politeness.get_state()
+        return {
+            domain: {
+                **politeness_state.get(domain, {}),
+                'latency': state.latency,
+                'error_rate': state.error_rate,
+            }
+            for domain, state in self.states.items()
+        }
@@ -1,8 +1,13 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import random
 from pathlib import Path
-from logging.handlers import TimedRotatingFileHandler
-from typing import List, Literal
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, List, Literal
 
 # os.environ["LOG_DIR_PATH"] = 'D:\python_project\spider\logs'
 LOG_DIR_PATH = os.getenv("LOG_DIR_PATH")
@@ -14,12 +19,73 @@ if not LOG_DIR_PATH:
 if not PROJECT_NAME:
     PROJECT_NAME = 'project'
 
+# Background listeners writing the records of each logger, stopped (and flushed) at exit
+_listeners: Dict[str, QueueListener] = {}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON lines"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class LocalQueueHandler(QueueHandler):
+    """Queue handler for a listener in the same process: tracebacks are formatted by the listener's thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, they may change before the listener gets to the record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float, max_level: int = logging.INFO):
+        """
+        Keep only a random share of the records up to max_level, records above it are always kept.
+
+        Args:
+            rate: share of the records kept, between 0 and 1.
+            max_level: highest level that is sampled.
+        """
+        super().__init__()
+        self.rate = rate
+        self.max_level = max_level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > self.max_level or random.random() < self.rate
+
 
 def create_logger(
         log_name: str = PROJECT_NAME,
         log_dir_path: str = None,
-        log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+        log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO",
+        log_format: Literal["text", "json"] = "text",
+        sample_rate: float = 1.0
 ):
+    """
+    Create the logger, or return it if it already exists.
+
+    Records are put on a queue and written to the console and to a daily rotated file by a background thread,
+    so logging never waits for disk I/O.
+
+    Args:
+        log_name: name of the logger and of its log file.
+        log_dir_path: directory of the log file, defaults to LOG_DIR_PATH.
+        log_level: minimum level logged.
+        log_format: 'text' for human readable lines, 'json' for JSON lines.
+        sample_rate: share of the DEBUG and INFO records kept, warnings and errors are always kept.
+    """
     # Configure the log handler for the given log_name
     logger = logging.getLogger(log_name)
     if not logger.handlers:
@@ -33,7 +99,12 @@ def create_logger(
 
         # Set the log level
         logger.setLevel(getattr(logging, log_level))
-        log_format = '%(asctime)s | %(levelname)s | %(message)s'
+        if log_format == 'json':
+            file_formatter = stream_formatter = JsonFormatter(datefmt='%Y-%m-%d %H:%M:%S')
+        else:
+            text_format = '%(asctime)s | %(levelname)s | %(message)s'
+            file_formatter = logging.Formatter(text_format, datefmt='%Y-%m-%d %H:%M:%S')
+            stream_formatter = logging.Formatter(text_format)
 
         # File handler: rotate the log file daily
         file_handler = TimedRotatingFileHandler(
@@ -43,20 +114,40 @@ def create_logger(
             backupCount=7,
             encoding='utf-8'
         )
-
-        file_handler.setFormatter(logging.Formatter(log_format, datefmt='%Y-%m-%d %H:%M:%S'))
+        file_handler.setFormatter(file_formatter)
 
         # Console handler
         stream_handler = logging.StreamHandler()
-        stream_handler.setFormatter(logging.Formatter(log_format))
+        stream_handler.setFormatter(stream_formatter)
+
+        # The logger only enqueues records, the listener's thread formats and writes them
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+        listener.start()
+        _listeners[log_name] = listener
 
-        # Add handlers to the logger
-        logger.addHandler(file_handler)
-        logger.addHandler(stream_handler)
+        if sample_rate < 1:
+            logger.addFilter(SamplingFilter(sample_rate))
+        logger.addHandler(LocalQueueHandler(log_queue))
 
     return logger
 
 
+def flush_logger(log_name: str = PROJECT_NAME):
+    """Write the queued records of the logger, waiting for its background thread"""
+    listener = _listeners.get(log_name)
+    if listener is not None:
+        # stop() drains the queue, the listener is restarted for the following records
+        listener.stop()
+        listener.start()
+
+
+@atexit.register
+def _stop_listeners():
+    for listener in _listeners.values():
+        listener.stop()
+
+
 if __name__ == '__main__':
     logger = create_logger(log_level="DEBUG")
     logger.debug("debug")
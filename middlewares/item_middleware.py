@@ -1,9 +1,12 @@
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 from core.item import StableItem
 
 
 class ItemMiddleware:
+    BATCH_SIZE = 100  # Items saved at once by save_items()
+    BATCH_INTERVAL = 5  # Maximum seconds an item waits in the batch before it is saved
+
     def __init__(self, spider: 'Spider'):
         self.spider = spider
 
@@ -18,7 +21,7 @@ class ItemMiddleware:
             - StableItem: to continue to the next item middleware.
             - None: to discard this item.
         """
-        self.spider.logger.info(f"{self.spider.SPIDER_NAME} process item: {item}")
+        self.spider.logger.debug("%s process item: %s", self.spider.SPIDER_NAME, item)
 
         clean_res = await self.clean_item(item)
 
@@ -39,7 +42,7 @@ class ItemMiddleware:
             - StableItem: if the item passes the cleaning process.
             - None: if the item fails the cleaning process.
         """
-        self.spider.logger.info(f"{self.spider.SPIDER_NAME} clean item")
+        self.spider.logger.debug("%s clean item", self.spider.SPIDER_NAME)
 
         return item
 
@@ -53,6 +56,27 @@ class ItemMiddleware:
         Returns:
             - StableItem: the saved item.
         """
-        self.spider.logger.info(f"{self.spider.SPIDER_NAME} save item")
+        self.spider.logger.debug("%s save item", self.spider.SPIDER_NAME)
 
         return item
+
+    async def save_items(self, items: List['StableItem']) -> List['StableItem']:
+        """
+        Save a batch of cleaned items at once, e.g. with a bulk insert.
+
+        Override it to have the engine buffer the items for this middleware: they go through clean_item()
+        one by one and are saved by batches of BATCH_SIZE, or after BATCH_INTERVAL seconds, or at the end
+        of the crawl. process_item() is not called in that case.
+
+        Args:
+            items: The cleaned items to be saved.
+
+        Returns:
+            - List[StableItem]: the saved items, which continue to the next item middleware.
+        """
+        return [await self.save_item(item) for item in items]
+
+    @classmethod
+    def is_batching(cls) -> bool:
+        """Whether the middleware saves its items by batches"""
+        return cls.save_items is not ItemMiddleware.save_items
@@ -1,9 +1,9 @@
 from typing import Optional, Union
 
-from fake_useragent import UserAgent
-
 from core.request import StableRequest
 from core.response import StableResponse
+from utils.fingerprint import request_fingerprint
+from utils.user_agent import UserAgentProvider, get_default_provider
 
 
 class RequestMiddleware:
@@ -12,7 +12,7 @@ class RequestMiddleware:
 
     @staticmethod
     def get_ua():
-        return UserAgent().random
+        return get_default_provider().get()
 
     @staticmethod
     def cookie_list_to_cookie_str(cookies: list) -> str:
@@ -41,8 +41,8 @@ class RequestMiddleware:
             True if the request passes the filter.
             False if the request fails the filter.
         """
-        self.spider.logger.info("request filter")
-        return True
+        self.spider.logger.debug("request filter")
+        return self.spider.seen_set.add(request_fingerprint(request))
 
     async def process_request(
             self,
@@ -58,7 +58,7 @@ class RequestMiddleware:
             The request to be sent, or
             None to discard the request.
         """
-        self.spider.logger.info("process request")
+        self.spider.logger.debug("process request")
 
         # Basic filtering
         if request.need_request_filter:
@@ -67,6 +67,10 @@ class RequestMiddleware:
             # If the filter does not pass, return None
             if not filter_res:
                 return None
+            # The request is now in the seen set, the following middlewares must not filter it again
+            request.need_request_filter = False
+
+        return request
 
     async def process_response(
             self,
@@ -85,5 +89,35 @@ class RequestMiddleware:
             The response to proceed to the next step, or
             None to discard the response.
         """
-        self.spider.logger.info("process response")
+        self.spider.logger.debug("process response")
         return response
+
+
+class UserAgentMiddleware(RequestMiddleware):
+    def __init__(self, spider: 'Spider'):
+        """
+        Set a User-Agent header on the StableRequests that have none, drawn from the spider's
+        USER_AGENT_BROWSERS, USER_AGENT_OS and USER_AGENT_TYPES, or the fixed USER_AGENT.
+        """
+        super().__init__(spider)
+        self.user_agent = spider.USER_AGENT
+        self.sticky = spider.USER_AGENT_STICKY
+        self.provider = UserAgentProvider.from_spider(spider) if self.user_agent is None else None
+
+    def get_user_agent(self, request: 'StableRequest') -> str:
+        if self.user_agent is not None:
+            return self.user_agent
+        if self.sticky == 'domain':
+            return self.provider.get_sticky(request.domain)
+        if self.sticky == 'session' and request.meta.get('session') is not None:
+            return self.provider.get_sticky(str(request.meta['session']))
+        return self.provider.get()
+
+    async def process_request(
+            self,
+            request: 'StableRequest'
+    ) -> Optional[Union['StableRequest', None]]:
+        # Selenium requests use the browser's own agent
+        if isinstance(request, StableRequest) and not any(key.lower() == 'user-agent' for key in request.headers):
+            request.headers['User-Agent'] = self.get_user_agent(request)
+        return request
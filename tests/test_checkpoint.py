@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _chain_links(n: int, pages: int):
+    return [n + 1] if n + 1 < pages else []
+
+
+def _branching_links(n: int, pages: int):
+    # Every page is linked from several others and back to the start page
+    return [link for link in (n + 1, n + 2, n + 3) if link < pages] + [0]
+
+
+def _crawl(start_url: str, job_dir: str, pages: int, links):
+    # Imported in the crawler process only
+    from core.engine import Engine
+    from core.request import StableRequest
+    from core.spider import Spider
+
+    class ChainSpider(Spider):
+        SPIDER_NAME = 'checkpoint_test'
+        START_URL_LIST = [start_url]
+        DOWNLOAD_DELAY = 0
+        DOWNLOAD_DELAY_JITTER = 0
+        LOG_LEVEL = 'WARNING'
+        STATS_LOG_INTERVAL = None
+
+        async def parse(self, response, meta):
+            n = int(str(response.url).rsplit('/', 1)[1])
+            for link in links(n, pages):
+                yield StableRequest(str(response.url.join(f'/page/{link}')), callback=self.parse)
+
+    asyncio.run(Engine(ChainSpider(), concurrency=2, job_dir=job_dir).start())
+
+
+class _Site:
+    """Serves /page/n, kills the crawler on its first request for kill_page; served counts the pages answered"""
+
+    def __init__(self, kill_page: int):
+        self.served = Counter()
+        self.crawler_pid = None
+        self.killed = threading.Event()
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                n = int(self.path.rsplit('/', 1)[1])
+                if n == kill_page and site.crawler_pid is not None and not site.killed.is_set():
+                    # Let the journal thread write the pending request before the crash
+                    time.sleep(0.5)
+                    os.kill(site.crawler_pid, signal.SIGKILL)
+                    site.killed.set()
+                    return
+                site.served[n] += 1
+                body = f'<html><body>Page {n}</body></html>'.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.start_url = f'http://127.0.0.1:{self.server.server_address[1]}/page/0'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def _crash_and_resume(tmp_path, pages: int, links, kill_page: int) -> Counter:
+    site = _Site(kill_page)
+    context = multiprocessing.get_context('spawn')
+    args = (site.start_url, str(tmp_path / 'job'), pages, links)
+    try:
+        crawler = context.Process(target=_crawl, args=args)
+        crawler.start()
+        site.crawler_pid = crawler.pid
+        crawler.join(timeout=60)
+        assert site.killed.is_set()
+        assert crawler.exitcode == -signal.SIGKILL
+
+        resumed = context.Process(target=_crawl, args=args)
+        resumed.start()
+        resumed.join(timeout=60)
+        assert resumed.exitcode == 0
+    finally:
+        site.server.shutdown()
+    return site.served
+
+
+def test_resume_after_crash_fetches_every_page_once(tmp_path):
+    served = _crash_and_resume(tmp_path, pages=4, links=_chain_links, kill_page=2)
+    assert served == {n: 1 for n in range(4)}
+
+
+def test_resume_after_crash_filters_duplicate_links(tmp_path):
+    served = _crash_and_resume(tmp_path, pages=30, links=_branching_links, kill_page=3)
+    assert served == {n: 1 for n in range(30)}
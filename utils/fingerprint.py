@@ -0,0 +1,62 @@
+import hashlib
+import json
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _to_pairs(values) -> list:
+    """Flatten params/form data given as a dict or a list of pairs into (key, value) string pairs."""
+    if not values:
+        return []
+    items = values.items() if isinstance(values, dict) else values
+    pairs = []
+    for key, value in items:
+        if isinstance(value, (list, tuple)):
+            pairs.extend((str(key), str(v)) for v in value)
+        else:
+            pairs.append((str(key), str(value)))
+    return pairs
+
+
+def canonicalize_url(url: str, params=None) -> str:
+    """
+    Normalize a URL so that equivalent URLs compare equal:
+    lowercase scheme and host, default port and fragment dropped, query merged with params and sorted.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{parts.port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+
+    query = parse_qsl(parts.query, keep_blank_values=True) + _to_pairs(params)
+    return urlunsplit((scheme, netloc, parts.path or '/', urlencode(sorted(query)), ''))
+
+
+def request_fingerprint(request) -> bytes:
+    """
+    Fingerprint of a request: SHA1 of the method, the canonical URL (including params)
+    and the request body (data/json).
+    """
+    fingerprint = hashlib.sha1()
+    fingerprint.update(request.method.upper().encode())
+    fingerprint.update(b'\n')
+    fingerprint.update(canonicalize_url(request.url, request.params).encode())
+    fingerprint.update(b'\n')
+
+    data = request.data
+    if isinstance(data, (dict, list, tuple)):
+        fingerprint.update(urlencode(sorted(_to_pairs(data))).encode())
+    elif isinstance(data, str):
+        fingerprint.update(data.encode())
+    elif isinstance(data, bytes):
+        fingerprint.update(data)
+    fingerprint.update(b'\n')
+
+    if request.json is not None:
+        fingerprint.update(json.dumps(request.json, sort_keys=True, separators=(',', ':'), default=str).encode())
+    return fingerprint.digest()
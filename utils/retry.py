@@ -1,6 +1,17 @@
 import asyncio
+import datetime
+import email.utils
+import logging
+import random
+import socket
 import time
+import warnings
 from functools import wraps
+from typing import Dict, Iterable, Optional, Tuple, Type
+
+import httpx
+
+logger = logging.getLogger(__name__)
 
 
 def retry(max_retries=3, delay=5, exceptions=(Exception,)):
@@ -19,9 +30,12 @@ def retry(max_retries=3, delay=5, exceptions=(Exception,)):
                 except exceptions as e:
                     retries += 1
                     if retries > max_retries:
-                        print("Maximum retry limit reached, operation still failed")
+                        logger.error("%s still failing after %d retries: %s", func.__qualname__, max_retries, e)
                         raise e
-                    print(f"Exception occurred: {e}, retrying for the {retries} time, waiting for {delay} seconds")
+                    logger.warning(
+                        "%s failed: %s, retry %d of %d in %s seconds", func.__qualname__, e, retries, max_retries, delay
+                    )
+                    # Sleeps in the calling thread, pooled WebDriver calls run off the event loop
                     time.sleep(delay)
 
         return wrapper
@@ -30,6 +44,13 @@ def retry(max_retries=3, delay=5, exceptions=(Exception,)):
 
 
 def async_retry(max_retries=3, delay=5, exceptions=(Exception,)):
+    """Deprecated: downloads are retried by the scheduler's RetryPolicy, see Spider.RETRY_TIMES."""
+    warnings.warn(
+        "async_retry is deprecated, downloads are retried by RetryPolicy", DeprecationWarning, stacklevel=2
+    )
+    # Same fixed delay between attempts as before, without jitter or budget
+    policy = RetryPolicy(max_retries=max_retries, backoff_base=delay, backoff_max=delay, jitter=0, budget=None)
+
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
@@ -38,14 +59,171 @@ def async_retry(max_retries=3, delay=5, exceptions=(Exception,)):
                 try:
                     return await func(*args, **kwargs)
                 except exceptions as e:
-                    retries += 1
-                    if retries > max_retries:
-                        print("Maximum retry limit reached, operation still failed")
+                    retry_delay = policy.get_delay(retries, domain='')
+                    if retry_delay is None:
+                        logger.error("%s still failing after %d retries: %s", func.__qualname__, max_retries, e)
                         raise e
-                    print(e)
-                    print(f"Exception occurred: {e}, retrying for the {retries} time, waiting for {delay} seconds")
-                    await asyncio.sleep(delay)
+                    retries += 1
+                    logger.warning(
+                        "%s failed: %s, retry %d of %d in %s seconds", func.__qualname__, e, retries, max_retries,
+                        retry_delay
+                    )
+                    await asyncio.sleep(retry_delay)
 
         return wrapper
 
     return decorator
+
+
+class RetryBudget:
+    def __init__(self, capacity: float, refill_rate: float):
+        """
+        Token bucket bounding the retries sent to one domain.
+
+        Args:
+            capacity: maximum number of retries available at once.
+            refill_rate: retries regained per second.
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        """Spend one retry, return False when the budget is exhausted"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RetryPolicy:
+    RETRY_EXCEPTIONS = (
+        httpx.TimeoutException,
+        httpx.ConnectError,
+        httpx.ReadError,
+        httpx.WriteError,
+        httpx.RemoteProtocolError,
+    )
+    RETRY_HTTP_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+    def __init__(
+            self,
+            max_retries: int = 3,
+            backoff_base: float = 1,
+            backoff_max: float = 60,
+            jitter: float = 0.5,
+            retry_exceptions: Tuple[Type[BaseException], ...] = RETRY_EXCEPTIONS,
+            retry_http_codes: Iterable[int] = RETRY_HTTP_CODES,
+            max_retry_after: float = 300,
+            budget: Optional[float] = 10,
+            budget_refill_rate: float = 0.5
+    ):
+        """
+        When and after how long a failed download is tried again.
+
+        The delay grows exponentially with the number of retries, is randomized by the jitter so that retries
+        of requests that failed together spread out, and is raised to the server's Retry-After when there is one.
+        Connection errors caused by a failed DNS resolution are not retried.
+
+        Args:
+            max_retries: maximum number of retries per request.
+            backoff_base: delay before the first retry, in seconds.
+            backoff_max: maximum delay computed by the backoff.
+            jitter: fraction of the delay that is randomized, between 0 and 1.
+            retry_exceptions: exceptions worth a retry.
+            retry_http_codes: response status codes worth a retry.
+            max_retry_after: longest Retry-After honoured, the request is not retried when the server asks for more.
+            budget: retries available at once per domain, None for no budget.
+            budget_refill_rate: retries regained per second per domain.
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.retry_http_codes = frozenset(retry_http_codes)
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+        self.budget_refill_rate = budget_refill_rate
+        self._budgets: Dict[str, RetryBudget] = {}
+
+    @classmethod
+    def from_spider(cls, spider) -> 'RetryPolicy':
+        return cls(
+            max_retries=spider.RETRY_TIMES,
+            backoff_base=spider.RETRY_BACKOFF_BASE,
+            backoff_max=spider.RETRY_BACKOFF_MAX,
+            jitter=spider.RETRY_JITTER,
+            retry_http_codes=spider.RETRY_HTTP_CODES,
+            max_retry_after=spider.RETRY_MAX_RETRY_AFTER,
+            budget=spider.RETRY_BUDGET,
+            budget_refill_rate=spider.RETRY_BUDGET_REFILL_RATE,
+        )
+
+    def is_retryable_exception(self, exception: BaseException) -> bool:
+        if not isinstance(exception, self.retry_exceptions):
+            return False
+        # A name that does not resolve will not resolve a second later
+        cause = exception.__cause__ or exception.__context__
+        while cause is not None:
+            if isinstance(cause, socket.gaierror):
+                return False
+            cause = cause.__cause__ or cause.__context__
+        return True
+
+    def is_retryable_status(self, status_code: Optional[int]) -> bool:
+        return status_code in self.retry_http_codes
+
+    def get_backoff(self, retry_times: int) -> float:
+        """Delay before the retry_times-th retry (counted from 0), jittered"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** retry_times)
+        return delay * (1 - self.jitter * random.random())
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Seconds to wait according to a Retry-After header, given in seconds or as an HTTP date"""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+    def get_delay(self, retry_times: int, domain: str, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Delay before retrying a failed request.
+
+        Args:
+            retry_times: number of times the request has already been retried.
+            domain: the request's domain, charged for the retry.
+            retry_after: delay asked by the server, if any.
+
+        Returns:
+            - float: seconds to wait before the retry.
+            - None: the request must not be retried.
+        """
+        if retry_times >= self.max_retries:
+            return None
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        if self.budget is not None:
+            budget = self._budgets.get(domain)
+            if budget is None:
+                budget = self._budgets[domain] = RetryBudget(self.budget, self.budget_refill_rate)
+            if not budget.take():
+                return None
+
+        delay = self.get_backoff(retry_times)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
@@ -1,13 +1,21 @@
+import asyncio
+import logging
 import os
 import random
+import threading
 import time
-from typing import Optional, Literal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Literal
 
 from selenium import webdriver
-from selenium.common import NoSuchElementException
+from selenium.common import NoSuchElementException, TimeoutException, WebDriverException
 from selenium.webdriver import ActionChains
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.wait import WebDriverWait
 from undetected_chromedriver.options import ChromeOptions
 
 from core.response import StableResponse
@@ -15,6 +23,69 @@ from utils.retry import retry
 
 GRID_HUB_URL = os.getenv('GRID_HUB_URL', None)
 
+logger = logging.getLogger(__name__)
+
+# Browsers whose driver answers CDP commands, also behind a Remote/Grid session
+CDP_BROWSERS = frozenset({'chrome', 'chromium', 'msedge', 'microsoftedge'})
+
+# URL patterns blocked through CDP for each resource type
+RESOURCE_URL_PATTERNS = {
+    'image': ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp', '*.avif'],
+    'font': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'],
+    'media': ['*.mp4', '*.webm', '*.ogg', '*.mp3', '*.wav', '*.m4a', '*.avi', '*.mov', '*.m3u8', '*.ts'],
+    'stylesheet': ['*.css'],
+}
+
+
+class RenderProfile:
+    def __init__(
+            self,
+            block_resources: Iterable[Literal['image', 'font', 'media', 'stylesheet']] = (),
+            page_load_strategy: Literal['normal', 'eager', 'none'] = 'normal',
+            wait_for: Optional[str] = None,
+            wait_by: str = By.XPATH,
+            wait_timeout: float = 10
+    ):
+        """
+        How a page is rendered.
+
+        Args:
+            block_resources: resource types not downloaded. Images are blocked through Chrome prefs for the
+                driver's own profile, every type is blocked per page through CDP on Chromium browsers, local or
+                Remote/Grid. Other browsers only get the prefs, with a warning logged once per driver.
+            page_load_strategy: when driver.get() returns, applies to the profile the driver is started with.
+            wait_for: element to wait for after the page load instead of relying on the implicit wait.
+            wait_by: locator strategy of wait_for.
+            wait_timeout: maximum time to wait for wait_for.
+        """
+        self.block_resources = tuple(block_resources)
+        self.page_load_strategy = page_load_strategy
+        self.wait_for = wait_for
+        self.wait_by = wait_by
+        self.wait_timeout = wait_timeout
+
+    @property
+    def blocked_url_patterns(self) -> List[str]:
+        return [pattern for resource in self.block_resources for pattern in RESOURCE_URL_PATTERNS[resource]]
+
+    def to_dict(self) -> Dict:
+        return {
+            'block_resources': list(self.block_resources),
+            'page_load_strategy': self.page_load_strategy,
+            'wait_for': self.wait_for,
+            'wait_by': self.wait_by,
+            'wait_timeout': self.wait_timeout,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RenderProfile':
+        return cls(**data)
+
+
+FULL_RENDER = RenderProfile()  # Everything is loaded, driver.get() waits for the load event
+LIGHT_RENDER = RenderProfile(block_resources=('image', 'font', 'media'), page_load_strategy='eager')
+TEXT_RENDER = RenderProfile(block_resources=('image', 'font', 'media', 'stylesheet'), page_load_strategy='eager')
+
 
 class SeleniumDriver:
     def __init__(
@@ -26,7 +97,8 @@ class SeleniumDriver:
             grid_hub_url: str = GRID_HUB_URL,
             need_default_options: bool = True,
             timeout: int = 20,
-            debug: bool = False
+            debug: bool = False,
+            render_profile: Optional[RenderProfile] = None
     ):
         self.need_default_options = need_default_options
         self.timeout = timeout
@@ -39,6 +111,11 @@ class SeleniumDriver:
         else:
             self.grid_hub_url = GRID_HUB_URL
         self.debug = debug
+        self.render_profile = render_profile if render_profile is not None else FULL_RENDER
+        self._blocked_url_patterns: List[str] = []
+        self._cdp_unavailable = False  # Set once resource blocking has failed and been warned about
+        # WebDriver sessions are not thread safe, calls made from executor threads hold this lock
+        self.lock = threading.Lock()
         self.start_browser()
 
     def start_browser(self):
@@ -61,6 +138,8 @@ class SeleniumDriver:
             if not self.debug:
                 self.options.add_argument("--disable-dev-shm-usage")  # 防止grid报错
 
+        self._apply_render_options()
+
         if not self.debug:
             self.driver = webdriver.Remote(
                 command_executor=self.grid_hub_url,
@@ -74,6 +153,8 @@ class SeleniumDriver:
                 keep_alive=self.keep_alive
             )
 
+        self._blocked_url_patterns = []
+        self._cdp_unavailable = False
         self.driver.implicitly_wait(self.timeout)  # 全局自动等待元素加载，不要混合使用隐式、显式等待
         self.driver.maximize_window()  # 全屏打开
         self.action = ActionChains(self.driver)
@@ -85,9 +166,66 @@ class SeleniumDriver:
         print("driver异常")
         self.quit()
 
+    def _apply_render_options(self):
+        """Browser level part of the render profile: page load strategy and image blocking prefs"""
+        profile = self.render_profile
+        self.options.page_load_strategy = profile.page_load_strategy
+        if 'image' in profile.block_resources and hasattr(self.options, 'add_experimental_option'):
+            prefs = dict(self.options.experimental_options.get('prefs', {}))
+            prefs['profile.managed_default_content_settings.images'] = 2
+            self.options.add_experimental_option('prefs', prefs)
+
+    def _execute_cdp(self, cmd: str, params: Dict):
+        """Run a CDP command, through the chromedriver endpoint for Remote/Grid sessions"""
+        if hasattr(self.driver, 'execute_cdp_cmd'):
+            return self.driver.execute_cdp_cmd(cmd, params)
+        self.driver.command_executor.add_command('executeCdpCommand', 'POST', '/session/$sessionId/goog/cdp/execute')
+        return self.driver.execute('executeCdpCommand', {'cmd': cmd, 'params': params})['value']
+
+    def _set_blocked_urls(self, patterns: List[str]):
+        """Block resources of the next pages through CDP, when the browser supports it"""
+        if patterns == self._blocked_url_patterns or self._cdp_unavailable:
+            return
+        browser_name = self.driver.capabilities.get('browserName', '').lower()
+        if not hasattr(self.driver, 'execute_cdp_cmd') and browser_name not in CDP_BROWSERS:
+            self._warn_no_blocking(f"{browser_name or 'the browser'} does not support CDP")
+            return
+        try:
+            self._execute_cdp('Network.enable', {})
+            self._execute_cdp('Network.setBlockedURLs', {'urls': patterns})
+        except WebDriverException as e:
+            self._warn_no_blocking(e.msg or type(e).__name__)
+            return
+        self._blocked_url_patterns = patterns
+
+    def _warn_no_blocking(self, reason: str):
+        self._cdp_unavailable = True
+        logger.warning(f"Resource blocking of the render profile is not applied, pages load in full: {reason}")
+
     @retry()
-    def get(self, url):
+    def _load(self, url, profile: RenderProfile):
+        self._set_blocked_urls(profile.blocked_url_patterns)
         self.driver.get(url)
+
+    def _wait_for(self, profile: RenderProfile):
+        """Explicit wait for the profile's element, without mixing in the implicit wait"""
+        self.driver.implicitly_wait(0)
+        try:
+            WebDriverWait(self.driver, profile.wait_timeout).until(
+                expected_conditions.presence_of_element_located((profile.wait_by, profile.wait_for))
+            )
+        finally:
+            self.driver.implicitly_wait(self.timeout)
+
+    def get(self, url, render_profile: Optional[RenderProfile] = None):
+        """
+        Load a page and parse it. A wait_for element missing after its wait_timeout raises TimeoutException,
+        it is not retried: the page is there, the element is not.
+        """
+        profile = render_profile if render_profile is not None else self.render_profile
+        self._load(url, profile)
+        if profile.wait_for:
+            self._wait_for(profile)
         html = self.get_html()
         selector = StableResponse.parser_html(html)
         return selector
@@ -192,6 +330,113 @@ class SeleniumDriver:
             self.driver.quit()
             self.driver = None
 
+    def is_alive(self) -> bool:
+        """Health check: whether the browser session still answers"""
+        if not getattr(self, 'driver', None):
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+
+class SeleniumDriverPool:
+    def __init__(
+            self,
+            driver_factory: Callable[[], SeleniumDriver] = SeleniumDriver,
+            size: int = 1,
+            max_pages: Optional[int] = None
+    ):
+        """
+        Pool of SeleniumDriver instances (local browsers or Grid sessions) for asyncio code.
+
+        Drivers are created on first use, checked out with `async with pool.checkout() as driver`,
+        and every blocking WebDriver call goes through pool.run() on a dedicated thread pool.
+        A driver is health checked on checkout and recycled after max_pages pages or after a WebDriver error.
+
+        Args:
+            driver_factory: builds a new driver, called in a pool thread.
+            size: maximum number of drivers.
+            max_pages: number of checkouts after which a driver is replaced, None to keep it.
+        """
+        self.driver_factory = driver_factory
+        self.size = size
+        self.max_pages = max_pages
+        self._idle: List[SeleniumDriver] = []
+        self._pages: Dict[SeleniumDriver, int] = {}
+        self._slots = asyncio.Semaphore(size)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='selenium')
+        self._closed = False
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run a blocking WebDriver call on the pool's threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def acquire(self) -> SeleniumDriver:
+        if self._closed:
+            raise RuntimeError("SeleniumDriverPool is closed")
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                driver = self._idle.pop()
+                if await self.run(driver.is_alive):
+                    return driver
+                await self._discard(driver)
+
+            driver = await self.run(self.driver_factory)
+            self._pages[driver] = 0
+            return driver
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, driver: SeleniumDriver, broken: bool = False):
+        try:
+            self._pages[driver] = self._pages.get(driver, 0) + 1
+            # A driver released after close() is quit rather than kept
+            if self._closed or broken or (self.max_pages is not None and self._pages[driver] >= self.max_pages):
+                await self._discard(driver)
+            else:
+                self._idle.append(driver)
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def checkout(self):
+        driver = await self.acquire()
+        broken = False
+        try:
+            yield driver
+        except TimeoutException:
+            # A page or element that took too long says nothing about the browser
+            raise
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            await self.release(driver, broken=broken)
+
+    async def _discard(self, driver: SeleniumDriver):
+        self._pages.pop(driver, None)
+        try:
+            if self._closed:
+                # The pool's threads are gone
+                await asyncio.get_running_loop().run_in_executor(None, driver.quit)
+            else:
+                await self.run(driver.quit)
+        except Exception:
+            # The browser may already be gone, nothing more to release
+            pass
+
+    async def close(self):
+        """Wait for the WebDriver calls in flight, then quit the idle drivers; checked out ones are quit on release"""
+        self._closed = True
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        while self._idle:
+            await self._discard(self._idle.pop())
+
 
 if __name__ == '__main__':
     options = ChromeOptions()
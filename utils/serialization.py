@@ -0,0 +1,16 @@
+import base64
+from typing import Dict
+
+
+def json_default(value):
+    """json.dumps default hook: encode bytes, e.g. a request's data, as base64."""
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_object_hook(value: Dict):
+    """json.loads object hook: decode the bytes encoded by json_default."""
+    if len(value) == 1 and '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
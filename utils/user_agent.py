@@ -0,0 +1,144 @@
+import functools
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Used when the fake_useragent dataset is not available
+FALLBACK_USER_AGENTS: List[Dict] = [
+    {
+        'useragent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                     'Chrome/131.0.0.0 Safari/537.36',
+        'percent': 30.0, 'type': 'desktop', 'browser': 'Chrome', 'os': 'Windows',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+                     'Chrome/131.0.0.0 Safari/537.36',
+        'percent': 12.0, 'type': 'desktop', 'browser': 'Chrome', 'os': 'Mac OS X',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                     'Chrome/131.0.0.0 Safari/537.36',
+        'percent': 4.0, 'type': 'desktop', 'browser': 'Chrome', 'os': 'Linux',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                     'Chrome/131.0.0.0 Safari/537.36 Edg/131.0.0.0',
+        'percent': 8.0, 'type': 'desktop', 'browser': 'Edge', 'os': 'Windows',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0',
+        'percent': 4.0, 'type': 'desktop', 'browser': 'Firefox', 'os': 'Windows',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (X11; Linux x86_64; rv:133.0) Gecko/20100101 Firefox/133.0',
+        'percent': 1.0, 'type': 'desktop', 'browser': 'Firefox', 'os': 'Linux',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+                     'Version/18.1 Safari/605.1.15',
+        'percent': 5.0, 'type': 'desktop', 'browser': 'Safari', 'os': 'Mac OS X',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 18_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+                     'Version/18.1 Mobile/15E148 Safari/604.1',
+        'percent': 20.0, 'type': 'mobile', 'browser': 'Mobile Safari', 'os': 'iOS',
+    },
+    {
+        'useragent': 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) '
+                     'Chrome/131.0.0.0 Mobile Safari/537.36',
+        'percent': 16.0, 'type': 'mobile', 'browser': 'Chrome Mobile', 'os': 'Android',
+    },
+]
+
+
+@functools.lru_cache(maxsize=None)
+def load_user_agents() -> Tuple[Dict, ...]:
+    """The fake_useragent dataset, read once per process, or FALLBACK_USER_AGENTS if it cannot be loaded"""
+    try:
+        from fake_useragent.utils import load
+        return tuple(load()) or tuple(FALLBACK_USER_AGENTS)
+    except Exception:
+        return tuple(FALLBACK_USER_AGENTS)
+
+
+class UserAgentProvider:
+    TABLE_SIZE = 10_000  # Slots of a pool's lookup table, each agent gets a share proportional to its weight
+
+    def __init__(
+            self,
+            browsers: Optional[Iterable[str]] = None,
+            os: Optional[Iterable[str]] = None,
+            types: Optional[Iterable[str]] = ('desktop',),
+            user_agents: Optional[Iterable[Dict]] = None
+    ):
+        """
+        Hands out real-world User-Agent strings, drawn according to their usage share.
+
+        Each (browser, os) pool is built once into a lookup table in which an agent fills as many slots as its
+        weight, so that drawing an agent is a single random index.
+
+        Args:
+            browsers: browser names kept, e.g. ['Chrome', 'Firefox'], None for all of them.
+            os: operating systems kept, e.g. ['Windows', 'Mac OS X'], None for all of them.
+            types: device types kept among 'desktop', 'mobile' and 'tablet', None for all of them.
+            user_agents: records with 'useragent', 'percent', 'browser', 'os' and 'type' keys, defaults to the
+                fake_useragent dataset.
+        """
+        records = list(user_agents) if user_agents is not None else list(load_user_agents())
+        self.browsers = set(browsers) if browsers is not None else None
+        self.os = set(os) if os is not None else None
+        self.types = set(types) if types is not None else None
+        self.records = [
+            record for record in records
+            if (self.browsers is None or record.get('browser') in self.browsers)
+            and (self.os is None or record.get('os') in self.os)
+            and (self.types is None or record.get('type') in self.types)
+        ]
+        if not self.records:
+            raise ValueError(f"No user agent matches browsers={browsers}, os={os}, types={types}")
+        self._pools: Dict[Tuple[Optional[str], Optional[str]], List[str]] = {}
+        self._sticky: Dict[str, str] = {}
+        self.get_pool()
+
+    @classmethod
+    def from_spider(cls, spider) -> 'UserAgentProvider':
+        return cls(browsers=spider.USER_AGENT_BROWSERS, os=spider.USER_AGENT_OS, types=spider.USER_AGENT_TYPES)
+
+    def get_pool(self, browser: Optional[str] = None, os: Optional[str] = None) -> List[str]:
+        """Lookup table of the agents of a browser and/or OS, built on first use"""
+        key = (browser, os)
+        pool = self._pools.get(key)
+        if pool is None:
+            records = [
+                record for record in self.records
+                if (browser is None or record.get('browser') == browser) and (os is None or record.get('os') == os)
+            ]
+            if not records:
+                raise ValueError(f"No user agent for browser={browser}, os={os}")
+            total = sum(record.get('percent') or 0 for record in records)
+            pool = []
+            for record in records:
+                weight = (record.get('percent') or 0) / total if total else 1 / len(records)
+                # Agents too rare for a single slot are left out
+                pool.extend([record['useragent']] * round(weight * self.TABLE_SIZE))
+            if not pool:
+                pool = [record['useragent'] for record in records]
+            self._pools[key] = pool
+        return pool
+
+    def get(self, browser: Optional[str] = None, os: Optional[str] = None) -> str:
+        """A random agent, optionally of the given browser and/or OS"""
+        pool = self.get_pool(browser, os)
+        return pool[random.randrange(len(pool))]
+
+    def get_sticky(self, key: str) -> str:
+        """The same agent for every call with this key, e.g. a domain or a session"""
+        user_agent = self._sticky.get(key)
+        if user_agent is None:
+            user_agent = self._sticky[key] = self.get()
+        return user_agent
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_provider() -> UserAgentProvider:
+    """Provider of any desktop browser, shared by the process"""
+    return UserAgentProvider()